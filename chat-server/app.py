@@ -1,25 +1,69 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+import json
 import logging
 import asyncio
-from typing import Dict
+import os
+from typing import Dict, Iterator, Optional
 from session_manager import SessionManager
+from session_store import SQLiteSessionStore
 from kafka_handler import KafkaHandler
+from stream_buffer import StreamBufferPool
+from replay_buffer import ReplayBuffer
+from static_cache import StaticCache
+from ws_delivery import ClientConnection, DeliveryMetrics, SessionChannel
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Chat Server")
 
-# Initialize managers
-session_manager = SessionManager()
-kafka_handler = KafkaHandler()
-
-# Store active WebSocket connections
-active_connections: Dict[str, WebSocket] = {}
+# Initialize managers (set SESSION_DB_PATH to an empty string to keep sessions in memory only)
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "chat_sessions.db")
+session_manager = SessionManager(
+    store=SQLiteSessionStore(SESSION_DB_PATH) if SESSION_DB_PATH else None,
+    ttl=float(os.getenv("SESSION_CACHE_TTL", "3600")),
+    max_sessions=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "10000")),
+    max_bytes=int(os.getenv("SESSION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+)
+kafka_handler = KafkaHandler(
+    instance_id=os.getenv("CHAT_SERVER_INSTANCE_ID"),
+    wire_codec=os.getenv("WIRE_FORMAT", "json"),
+    compression_type=os.getenv("KAFKA_COMPRESSION_TYPE") or None,
+    linger_ms=int(os.getenv("KAFKA_LINGER_MS", "5")),
+    max_batch_size=int(os.getenv("KAFKA_MAX_BATCH_SIZE", "16384")),
+    acks=os.getenv("KAFKA_ACKS", "all")
+)
+
+# Store active sessions; each channel fans frames out to all of the session's
+# WebSocket connections, each connection with a bounded outbound queue
+active_connections: Dict[str, SessionChannel] = {}
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "256"))
+SEND_QUEUE_OVERFLOW = os.getenv("SEND_QUEUE_OVERFLOW", "coalesce")
+
+# Per-session chunk coalescing (merge chunks arriving within the window)
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW_MS", "20")) / 1000
+COALESCE_MAX_BYTES = int(os.getenv("COALESCE_MAX_BYTES", "4096"))
+delivery_metrics = DeliveryMetrics()
 
 # Store streaming message buffers (accumulate chunks)
-streaming_buffers: Dict[str, str] = {}
+streaming_buffers = StreamBufferPool()
+
+# Recent chunks per session, replayed to clients reconnecting with last_seq
+replay_buffer = ReplayBuffer(max_entries=int(os.getenv("REPLAY_BUFFER_SIZE", "512")))
+
+# Request whose answer is still streaming, per session. The orchestrator is
+# told to cancel it when a newer message supersedes it, or when nobody has
+# been connected to the session for CANCEL_GRACE_SECONDS (reconnecting
+# clients resume the stream within that time).
+in_flight_requests: Dict[str, str] = {}
+CANCEL_GRACE_SECONDS = float(os.getenv("CANCEL_GRACE_SECONDS", "5"))
+
+# How often idle stream buffers are evicted (seconds)
+STREAM_EVICTION_INTERVAL = 30.0
+
+# Static assets are served from memory; in dev mode they reload when changed on disk
+static_cache = StaticCache("static", reload=os.getenv("CHAT_SERVER_DEV") == "1")
 
 # Store reference to main event loop
 main_event_loop = None
@@ -30,49 +74,93 @@ async def startup_event():
     global main_event_loop
     main_event_loop = asyncio.get_running_loop()
     logger.info("Starting chat server...")
-    kafka_handler.connect()
+    static_cache.load("index.html")
+    await kafka_handler.connect_async()
     kafka_handler.start_consumer(handle_kafka_response)
+    asyncio.create_task(evict_idle_streams())
     logger.info("Chat server started successfully")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    kafka_handler.stop()
+    await kafka_handler.stop_async()
+    session_manager.close()
     logger.info("Chat server shutdown")
 
 
-def handle_kafka_response(session_id: str, response: str, is_chunk: bool = False, is_done: bool = False):
-    """Callback for Kafka consumer to handle responses (including streaming chunks)"""
+async def evict_idle_streams():
+    """Drop buffers of streams that never finished (e.g. orchestrator crashed mid-stream)
+    and idle sessions from the session cache"""
+    while True:
+        await asyncio.sleep(STREAM_EVICTION_INTERVAL)
+        streaming_buffers.evict_idle()
+        replay_buffer.evict_idle()
+        session_manager.evict_expired()
 
-    # Initialize buffer for this session if needed
-    if session_id not in streaming_buffers:
-        streaming_buffers[session_id] = ""
+
+def handle_kafka_response(session_id: str, response: str, is_chunk: bool = False,
+                          is_done: bool = False, seq: Optional[int] = None,
+                          request_id: Optional[str] = None):
+    """Callback for Kafka consumer to handle responses (including streaming chunks)"""
 
     # Accumulate chunks
     if is_chunk and response:
-        streaming_buffers[session_id] += response
+        streaming_buffers.append(session_id, response)
 
     # When streaming is done, save complete message
     if is_done:
-        complete_message = streaming_buffers[session_id]
+        complete_message = streaming_buffers.finish(session_id)
         if complete_message:
             session_manager.add_message(session_id, "assistant", complete_message)
-        # Clear buffer
-        streaming_buffers[session_id] = ""
-
-    # Send to WebSocket if connected
-    if session_id in active_connections:
-        websocket = active_connections[session_id]
-        try:
-            if main_event_loop:
-                asyncio.run_coroutine_threadsafe(
-                    send_streaming_to_websocket(websocket, response, is_chunk, is_done),
-                    main_event_loop
-                )
-            else:
-                logger.error("Main event loop not available")
-        except Exception as e:
-            logger.error(f"Error scheduling WebSocket message: {e}")
+        if main_event_loop:
+            main_event_loop.call_soon_threadsafe(finish_request, session_id, request_id)
+
+    # Responses without a sequence number cannot be replayed, so they only
+    # matter while a WebSocket is connected
+    if seq is None and session_id not in active_connections:
+        return
+    if not main_event_loop:
+        logger.error("Main event loop not available")
+        return
+
+    try:
+        main_event_loop.call_soon_threadsafe(deliver_response, session_id, response, is_chunk, is_done, seq)
+    except Exception as e:
+        logger.error(f"Error scheduling WebSocket message: {e}")
+
+
+def finish_request(session_id: str, request_id: Optional[str]):
+    """Forget a session's in-flight request once its answer is done (runs on the event loop)"""
+    # Responses from orchestrators that don't echo request_id end whatever is in flight
+    if request_id is None or in_flight_requests.get(session_id) == request_id:
+        in_flight_requests.pop(session_id, None)
+
+
+async def cancel_if_abandoned(session_id: str, request_id: str):
+    """Cancel an answer nobody is connected to receive, after a grace period for reconnects"""
+    await asyncio.sleep(CANCEL_GRACE_SECONDS)
+    if session_id in active_connections or in_flight_requests.get(session_id) != request_id:
+        return
+    del in_flight_requests[session_id]
+    await kafka_handler.send_cancel_async(session_id, request_id, "disconnected")
+
+
+def deliver_response(session_id: str, response: str, is_chunk: bool, is_done: bool, seq: Optional[int]):
+    """Record a response for replay and pass it to the session's sockets (runs on the event loop)"""
+    is_chunk = is_chunk and bool(response)
+    if not (is_chunk or is_done):
+        return
+
+    if seq is not None:
+        replay_buffer.record(session_id, seq, response if is_chunk else "", is_done)
+
+    channel = active_connections.get(session_id)
+    if channel is None:
+        return
+    if is_chunk:
+        channel.add_chunk(response, seq)
+    else:
+        channel.finish(seq)
 
 
 async def send_message_to_websocket(websocket: WebSocket, message: str):
@@ -85,28 +173,22 @@ async def send_message_to_websocket(websocket: WebSocket, message: str):
         logger.error(f"Failed to send message via WebSocket: {e}")
 
 
-async def send_streaming_to_websocket(websocket: WebSocket, chunk: str, is_chunk: bool, is_done: bool):
-    try:
-        if is_chunk and chunk:
-            # Send chunk
-            await websocket.send_json({
-                "type": "assistant_chunk",
-                "chunk": chunk
-            })
-        elif is_done:
-            # Send done signal
-            await websocket.send_json({
-                "type": "assistant_done"
-            })
-    except Exception as e:
-        logger.error(f"Failed to send streaming message via WebSocket: {e}")
-
-
 @app.get("/")
-async def get():
-    with open("static/index.html", "r") as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content)
+async def get(request: Request):
+    asset = static_cache.get("index.html")
+    body, encoding = asset.negotiate(request.headers.get("accept-encoding", ""))
+    etag = asset.etag(encoding)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding"
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.media_type, headers=headers)
 
 
 @app.post("/api/sessions")
@@ -116,26 +198,147 @@ async def create_session():
     return {"session_id": session_id}
 
 
+# Number of items encoded per streamed write
+JSON_STREAM_BATCH = 100
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def stream_json(items: Iterator[Dict], prefix: str, suffix: str) -> Iterator[str]:
+    """Encode a JSON array incrementally instead of building the whole body"""
+    yield prefix
+    batch = []
+    first = True
+    for item in items:
+        batch.append(json.dumps(item))
+        if len(batch) >= JSON_STREAM_BATCH:
+            yield ("" if first else ",") + ",".join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield ("" if first else ",") + ",".join(batch)
+    yield suffix
+
+
+def paged_response(items: Iterator[Dict], prefix: str, suffix: str, etag: str,
+                   next_cursor: Optional[str]) -> StreamingResponse:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    return StreamingResponse(
+        stream_json(items, prefix, suffix),
+        media_type="application/json",
+        headers=headers
+    )
+
+
 @app.get("/api/sessions")
-async def get_sessions():
-    """Get all chat sessions"""
-    return session_manager.get_all_sessions()
+async def get_sessions(request: Request, cursor: Optional[str] = None,
+                       limit: Optional[int] = Query(None, ge=1, le=1000)):
+    """Get chat sessions, oldest first.
+
+    Pass ``limit`` to page through sessions; the cursor for the next page is
+    returned in the ``X-Next-Cursor`` header.
+    """
+    etag = f'"{session_manager.epoch}-{session_manager.version}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    try:
+        sessions, next_cursor = session_manager.get_sessions_page(cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return paged_response(sessions, "[", "]", etag, next_cursor)
 
 
 @app.get("/api/sessions/{session_id}/messages")
-async def get_session_messages(session_id: str):
-    """Get messages for a specific session"""
+async def get_session_messages(request: Request, session_id: str,
+                               cursor: int = Query(0, ge=0),
+                               limit: Optional[int] = Query(None, ge=1, le=1000)):
+    """Get messages for a specific session.
+
+    ``cursor`` is the index of the first message to return; the cursor for
+    the next page is returned in the ``X-Next-Cursor`` header.
+    """
     try:
-        messages = session_manager.get_messages(session_id)
-        return {"messages": messages}
+        version = session_manager.get_session_version(session_id)
+        etag = f'"{session_manager.epoch}-{version}"'
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        messages, next_cursor = session_manager.get_messages_page(session_id, cursor, limit)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    return paged_response(messages, '{"messages": [', "]}", etag, next_cursor)
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Streaming delivery metrics"""
+    return {
+        "websocket": delivery_metrics.snapshot(),
+        "stream_buffers": streaming_buffers.stats(),
+        "replay_buffer": replay_buffer.stats(),
+        "session_cache": session_manager.cache_stats()
+    }
+
+
+# Priority classes the orchestrator schedules by, highest first
+REQUEST_PRIORITIES = ("interactive", "batch")
+# Tenants (and their weighted share) are only taken from the X-Tenant-ID header
+# set by an authenticating proxy; TRUST_TENANT_PARAM=1 also accepts the
+# unauthenticated ?tenant= query parameter, e.g. for local testing
+TRUST_TENANT_PARAM = os.getenv("TRUST_TENANT_PARAM", "0") == "1"
 
 
 @app.websocket("/ws/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
+async def websocket_endpoint(websocket: WebSocket, session_id: str, last_seq: Optional[int] = None,
+                             tenant: Optional[str] = None, priority: Optional[str] = None):
+    """Chat WebSocket. A client reconnecting mid-stream passes the ``seq`` of
+    the last frame it received as ``last_seq`` to be sent only what it missed.
+
+    Requests are sent under the connection's tenant and ``priority``
+    (``interactive`` or ``batch``), which set their fair share in the
+    orchestrator. The tenant comes from the ``X-Tenant-ID`` header set by an
+    authenticating proxy; the ``tenant`` query parameter is ignored unless
+    TRUST_TENANT_PARAM is set.
+    """
+    tenant = websocket.headers.get("x-tenant-id") or (tenant if TRUST_TENANT_PARAM else None)
+    if priority not in REQUEST_PRIORITIES:
+        priority = None
     await websocket.accept()
-    active_connections[session_id] = websocket
+    connection = ClientConnection(
+        websocket,
+        max_queue=SEND_QUEUE_SIZE,
+        overflow=SEND_QUEUE_OVERFLOW,
+        metrics=delivery_metrics
+    )
+    connection.start()
+    channel = active_connections.get(session_id)
+    if channel is None:
+        channel = active_connections[session_id] = SessionChannel(
+            window=COALESCE_WINDOW,
+            max_bytes=COALESCE_MAX_BYTES
+        )
+
+    if last_seq is not None:
+        # Chunks still waiting in the coalescer are already in the replay
+        # buffer; flush them to the other sockets so they are not sent twice
+        channel.flush()
+        frames = replay_buffer.frames_since(session_id, last_seq)
+        if frames is None:
+            # The missed chunks were dropped from the ring, reload the history
+            connection.send_frame({"type": "resync"})
+        else:
+            for frame in frames:
+                connection.send_frame(frame)
+    channel.subscribe(connection)
     logger.info(f"WebSocket connected for session {session_id}")
 
     try:
@@ -151,11 +354,19 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                 # Add user message to session
                 session_manager.add_message(session_id, "user", message)
 
-                # Send to Kafka
-                kafka_handler.send_request(session_id, message)
+                # A new message supersedes an answer that is still streaming
+                superseded = in_flight_requests.pop(session_id, None)
+                if superseded:
+                    await kafka_handler.send_cancel_async(session_id, superseded, "superseded")
+
+                # Send to Kafka without blocking other sockets; the ack is
+                # only sent once the broker has acknowledged the record
+                in_flight_requests[session_id] = await kafka_handler.send_request_async(
+                    session_id, message, tenant=tenant, priority=priority
+                )
 
                 # Acknowledge receipt
-                await websocket.send_json({
+                connection.send_frame({
                     "type": "ack",
                     "message": "Message received"
                 })
@@ -165,8 +376,14 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
     except Exception as e:
         logger.error(f"WebSocket error for session {session_id}: {e}")
     finally:
-        if session_id in active_connections:
+        connection.close()
+        channel.unsubscribe(connection)
+        if not channel.subscribers and active_connections.get(session_id) is channel:
             del active_connections[session_id]
+            channel.close()
+            request_id = in_flight_requests.get(session_id)
+            if request_id:
+                asyncio.create_task(cancel_if_abandoned(session_id, request_id))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Measure in-memory bytes per chat message, before and after the compact
+Message representation
+"""
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from session_manager import Message
+
+MESSAGES = 100_000
+
+
+@dataclass
+class LegacyMessage:
+    """Message representation before the compact one (for comparison)"""
+    role: str
+    content: str
+    timestamp: str = field(default_factory=lambda: datetime.now().isoformat())
+
+
+def measure(factory, contents):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = [factory("user" if i % 2 == 0 else "assistant", content)
+                for i, content in enumerate(contents)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(messages), messages
+
+
+def main():
+    # Content strings are allocated up front so only the overhead is measured
+    contents = [f"message {i}" for i in range(MESSAGES)]
+
+    legacy, _ = measure(lambda role, content: LegacyMessage(role=role, content=content), contents)
+    compact, _ = measure(lambda role, content: Message(role=role, content=content), contents)
+
+    print("=" * 60)
+    print(f"MESSAGE MEMORY ({MESSAGES} messages, content excluded)")
+    print("=" * 60)
+    print(f"  dataclass + ISO timestamp: {legacy:8.1f} bytes/message")
+    print(f"  slotted + float timestamp: {compact:8.1f} bytes/message")
+    print(f"  reduction:                 {100 * (1 - compact / legacy):8.1f} %")
+
+
+if __name__ == "__main__":
+    main()
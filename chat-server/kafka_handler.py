@@ -1,51 +1,135 @@
-import json
 import logging
-from kafka import KafkaProducer, KafkaConsumer
-from kafka.errors import KafkaError
+from kafka import KafkaConsumer
+from aiokafka import AIOKafkaProducer
+from aiokafka.errors import KafkaError as AIOKafkaError
 from threading import Thread
+import re
+import socket
 import time
+import uuid
+import wire_format
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def stable_instance_id(instance_id: str = None) -> str:
+    """The configured instance id, or the host name when none is set"""
+    instance_id = instance_id or socket.gethostname()
+    # Topic names may only contain ASCII letters, digits, '.', '_' and '-'
+    instance_id = re.sub(r'[^a-zA-Z0-9._-]', '-', instance_id)
+    if not instance_id:
+        raise ValueError("CHAT_SERVER_INSTANCE_ID must be set when the host name is empty")
+    return instance_id
+
+
 class KafkaHandler:
-    def __init__(self, bootstrap_servers='localhost:9092'):
+    def __init__(self, bootstrap_servers='localhost:9092', linger_ms=5,
+                 max_batch_size=16384, acks='all', instance_id=None,
+                 wire_codec='json', compression_type=None):
         self.bootstrap_servers = bootstrap_servers
-        self.producer = None
+        # Requests are encoded with wire_codec; responses in any wire format are accepted
+        self.wire_codec = wire_codec
+        self.compression_type = compression_type
+        # Each chat-server instance consumes its own reply topic, so responses
+        # always reach the replica that holds the session's WebSocket. The id
+        # must survive restarts: a new one would leave the old topic and
+        # consumer group behind, along with any responses still in flight
+        self.instance_id = stable_instance_id(instance_id)
+        self.reply_topic = f"chat-responses.{self.instance_id}"
+        self.linger_ms = linger_ms
+        self.max_batch_size = max_batch_size
+        self.acks = acks
+        self.async_producer = None
         self.consumer = None
         self.running = False
         self.message_callbacks = {}
 
-    def connect(self):
+    async def connect_async(self):
+        """Start the asyncio producer used by the WebSocket ingest path"""
         try:
-            self.producer = KafkaProducer(
+            self.async_producer = AIOKafkaProducer(
                 bootstrap_servers=self.bootstrap_servers,
-                value_serializer=lambda v: json.dumps(v).encode('utf-8'),
-                max_block_ms=5000
+                key_serializer=lambda k: k.encode('utf-8'),
+                value_serializer=self._serialize,
+                compression_type=self.compression_type,
+                linger_ms=self.linger_ms,
+                max_batch_size=self.max_batch_size,
+                acks=self.acks,
+                enable_idempotence=self.acks == 'all'
             )
-            logger.info("Kafka producer connected")
+            await self.async_producer.start()
+            logger.info("Async Kafka producer connected")
         except Exception as e:
-            logger.error(f"Failed to connect Kafka producer: {e}")
+            logger.error(f"Failed to connect async Kafka producer: {e}")
             raise
 
-    def send_request(self, session_id: str, message: str):
-        if not self.producer:
-            raise Exception("Kafka producer not connected")
+    def _serialize(self, value) -> bytes:
+        # Records of other schemas (e.g. control messages) are encoded by the caller
+        if isinstance(value, bytes):
+            return value
+        return wire_format.encode(value, "chat_request", self.wire_codec)
 
-        payload = {
+    def _build_request(self, session_id: str, message: str, tenant: str = None,
+                       priority: str = None) -> dict:
+        # request_id identifies the request across redeliveries, so the
+        # orchestrator can skip requests it already answered. tenant and
+        # priority ("interactive" or "batch") select the request's fair share
+        # in the orchestrator; unset, the session is its own tenant and the
+        # request is interactive.
+        return {
             "session_id": session_id,
             "message": message,
-            "timestamp": time.time()
+            "timestamp": time.time(),
+            "reply_topic": self.reply_topic,
+            "request_id": uuid.uuid4().hex,
+            "tenant": tenant,
+            "priority": priority
         }
 
+    async def send_request_async(self, session_id: str, message: str, tenant: str = None,
+                                 priority: str = None) -> str:
+        """Send a request without blocking the event loop, waiting for delivery.
+
+        Returns the request's request_id.
+        """
+        if not self.async_producer:
+            raise Exception("Async Kafka producer not connected")
+
+        payload = self._build_request(session_id, message, tenant, priority)
         try:
-            future = self.producer.send('chat-requests', value=payload)
-            future.get(timeout=10)
+            delivery = await self.async_producer.send('chat-requests', key=session_id, value=payload)
+            await delivery
             logger.info(f"Sent message to Kafka for session {session_id}")
-        except KafkaError as e:
+        except AIOKafkaError as e:
             logger.error(f"Failed to send message to Kafka: {e}")
             raise
+        return payload["request_id"]
+
+    async def send_cancel_async(self, session_id: str, request_id: str, reason: str):
+        """Ask the orchestrator to stop working on a request.
+
+        Published on the ``chat-control`` topic, keyed by session_id like the
+        request itself. Does not wait for delivery.
+        """
+        if not self.async_producer:
+            raise Exception("Async Kafka producer not connected")
+
+        control = {
+            "session_id": session_id,
+            "request_id": request_id,
+            "reason": reason,
+            "timestamp": time.time()
+        }
+        try:
+            await self.async_producer.send(
+                'chat-control',
+                key=session_id,
+                value=wire_format.encode(control, "chat_control", self.wire_codec)
+            )
+            logger.info(f"Requested cancellation of {request_id} for session {session_id} ({reason})")
+        except AIOKafkaError as e:
+            logger.error(f"Failed to send cancellation to Kafka: {e}")
 
     def start_consumer(self, callback):
         self.running = True
@@ -57,14 +141,14 @@ class KafkaHandler:
     def _consume_responses(self, callback):
         try:
             self.consumer = KafkaConsumer(
-                'chat-responses',
+                self.reply_topic,
                 bootstrap_servers=self.bootstrap_servers,
-                value_deserializer=lambda m: json.loads(m.decode('utf-8')),
+                value_deserializer=wire_format.decode,
                 auto_offset_reset='latest',
-                group_id='chat-server-group',
+                group_id=f'chat-server-{self.instance_id}',
                 enable_auto_commit=True
             )
-            logger.info("Kafka consumer connected to chat-responses topic")
+            logger.info(f"Kafka consumer connected to {self.reply_topic} topic")
 
             for message in self.consumer:
                 if not self.running:
@@ -84,7 +168,7 @@ class KafkaHandler:
                     else:
                         logger.info(f"Received response for session {session_id}")
 
-                    callback(session_id, response, is_chunk, is_done)
+                    callback(session_id, response, is_chunk, is_done, data.get('seq'), data.get('request_id'))
                 except Exception as e:
                     logger.error(f"Error processing Kafka message: {e}")
         except Exception as e:
@@ -94,6 +178,10 @@ class KafkaHandler:
         self.running = False
         if self.consumer:
             self.consumer.close()
-        if self.producer:
-            self.producer.close()
         logger.info("Kafka handler stopped")
+
+    async def stop_async(self):
+        if self.async_producer:
+            await self.async_producer.stop()
+            self.async_producer = None
+        self.stop()
@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+from ws_delivery import chunk_frame, done_frame
+
+
+class _Replay:
+    __slots__ = ("entries", "dropped_seq", "last_update")
+
+    def __init__(self, max_entries: int):
+        # (seq, chunk, is_done) tuples, oldest first
+        self.entries = deque(maxlen=max_entries)
+        # Sequence number of the newest entry pushed out of the ring
+        self.dropped_seq = None
+        self.last_update = time.monotonic()
+
+
+class ReplayBuffer:
+    """Bounded per-session ring buffer of recent response chunks.
+
+    Every chunk and done signal that carries a sequence number is recorded,
+    whether or not a WebSocket is connected, so a client reconnecting with
+    the last sequence number it saw can be sent only what it missed. Each
+    session keeps at most ``max_entries`` entries, and sessions without new
+    entries for ``idle_timeout`` seconds are dropped by ``evict_idle``.
+
+    All methods must be called on the event loop.
+    """
+
+    def __init__(self, max_entries: int = 512, idle_timeout: float = 300.0):
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self._sessions: "OrderedDict[str, _Replay]" = OrderedDict()
+
+    def record(self, session_id: str, seq: int, chunk: str, is_done: bool):
+        replay = self._sessions.get(session_id)
+        if replay is None:
+            replay = self._sessions[session_id] = _Replay(self.max_entries)
+        else:
+            self._sessions.move_to_end(session_id)
+        if len(replay.entries) == replay.entries.maxlen:
+            replay.dropped_seq = replay.entries[0][0]
+        replay.entries.append((seq, chunk, is_done))
+        replay.last_update = time.monotonic()
+
+    def frames_since(self, session_id: str, last_seq: int) -> Optional[List[dict]]:
+        """Return the frames a client that saw ``last_seq`` has missed.
+
+        Consecutive chunks are merged into one frame. Returns None when the
+        missed entries have already been dropped from the buffer, in which
+        case the client has to reload the history instead.
+        """
+        replay = self._sessions.get(session_id)
+        if replay is None:
+            return []
+        if replay.dropped_seq is not None and replay.dropped_seq > last_seq:
+            return None
+
+        frames = []
+        chunks: List[str] = []
+        chunk_seq = None
+        for seq, chunk, is_done in replay.entries:
+            if seq <= last_seq:
+                continue
+            if is_done:
+                if chunks:
+                    frames.append(chunk_frame("".join(chunks), chunk_seq))
+                    chunks = []
+                frames.append(done_frame(seq))
+            else:
+                chunks.append(chunk)
+                chunk_seq = seq
+        if chunks:
+            frames.append(chunk_frame("".join(chunks), chunk_seq))
+        return frames
+
+    def evict_idle(self) -> int:
+        deadline = time.monotonic() - self.idle_timeout
+        evicted = 0
+        while self._sessions:
+            session_id, replay = next(iter(self._sessions.items()))
+            if replay.last_update > deadline:
+                break
+            del self._sessions[session_id]
+            evicted += 1
+        return evicted
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "entries": sum(len(replay.entries) for replay in self._sessions.values())
+        }
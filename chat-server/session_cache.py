@@ -0,0 +1,174 @@
+"""
+LRU session cache shared by chat-server and conversational-workflow
+(keep both copies identical; `python check_shared_modules.py` compares them).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SessionCache:
+    """LRU cache of per-session state with idle TTL and size limits.
+
+    Entries are ordered by last access. An entry is evicted when it has not
+    been accessed for ``ttl`` seconds, or, least recently used first, when
+    the cache holds more than ``max_sessions`` entries or more than
+    ``max_bytes`` as measured by ``size_of``.
+
+    ``on_evict(key, value)`` is called for every evicted entry so it can be
+    offloaded to a persistent store, and ``loader(key)`` is called on a miss
+    to rehydrate it (returning None when the key is unknown). Both run with
+    the cache lock held and must not call back into the cache.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_sessions: Optional[int] = None,
+                 max_bytes: Optional[int] = None, size_of: Callable[[Any], int] = None,
+                 loader: Callable[[Hashable], Any] = None,
+                 on_evict: Callable[[Hashable, Any], None] = None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.size_of = size_of or (lambda value: 0)
+        self.loader = loader
+        self.on_evict = on_evict
+        # key -> [value, size, last_access], least recently used first
+        self._entries: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry[2] = time.monotonic()
+                self._entries.move_to_end(key)
+                return entry[0]
+
+            self.misses += 1
+            if self.loader is None:
+                return default
+            value = self.loader(key)
+            if value is None:
+                return default
+            self._insert(key, value)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._evict_expired()
+            self._insert(key, value)
+
+    def resize(self, key: Hashable, delta: int = None):
+        """Re-measure an entry after its value was mutated in place.
+
+        Pass ``delta`` to adjust the size by a known amount instead of
+        measuring the whole value again.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            size = entry[1] + delta if delta is not None else self.size_of(entry[0])
+            self._bytes += size - entry[1]
+            entry[1] = size
+            entry[2] = time.monotonic()
+            self._entries.move_to_end(key)
+            self._enforce_limits(keep=key)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry without offloading it"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def evict_expired(self) -> int:
+        with self._lock:
+            return self._evict_expired()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: Hashable):
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(key)
+            self.pop(key)
+
+    def _insert(self, key: Hashable, value: Any):
+        size = self.size_of(value)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = [value, size, time.monotonic()]
+        self._bytes += size
+        self._enforce_limits(keep=key)
+
+    def _evict_expired(self) -> int:
+        if self.ttl is None:
+            return 0
+        deadline = time.monotonic() - self.ttl
+        evicted = 0
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[2] > deadline:
+                break
+            self._evict(key)
+            evicted += 1
+        return evicted
+
+    def _enforce_limits(self, keep: Hashable = None):
+        while self._entries:
+            over_count = self.max_sessions is not None and len(self._entries) > self.max_sessions
+            over_bytes = self.max_bytes is not None and self._bytes > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            key = next(iter(self._entries))
+            if key == keep:
+                # Never evict the entry that is being written
+                break
+            self._evict(key)
+
+    def _evict(self, key: Hashable):
+        value, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        self.evictions += 1
+        if self.on_evict is not None:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                logger.error(f"Failed to offload evicted session {key}: {e}")
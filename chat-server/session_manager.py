@@ -1,14 +1,55 @@
+import bisect
+import threading
+import time
 import uuid
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Tuple
 from dataclasses import dataclass, field
+from session_cache import SessionCache
+from session_store import SessionStore
+
+# Approximate per-message overhead used when sizing cached sessions
+MESSAGE_OVERHEAD_BYTES = 200
+
+
+# Roles are stored as small integer codes
+ROLES: List[str] = ["user", "assistant", "system"]
+ROLE_CODES: Dict[str, int] = {role: code for code, role in enumerate(ROLES)}
+
+
+def role_code(role: str) -> int:
+    code = ROLE_CODES.get(role)
+    if code is None:
+        code = ROLE_CODES.setdefault(role, len(ROLES))
+        if code == len(ROLES):
+            ROLES.append(role)
+    return code
 
 
-@dataclass
 class Message:
-    role: str
-    content: str
-    timestamp: str = field(default_factory=lambda: datetime.now().isoformat())
+    """A chat message.
+
+    Messages are slotted, keep the role as an interned code and the time as a
+    float, and only format the ISO timestamp when it is read.
+    """
+
+    __slots__ = ("role_code", "content", "created")
+
+    def __init__(self, role: str, content: str, created: float = None):
+        self.role_code = role_code(role)
+        self.content = content
+        self.created = time.time() if created is None else created
+
+    @property
+    def role(self) -> str:
+        return ROLES[self.role_code]
+
+    @property
+    def timestamp(self) -> str:
+        return datetime.fromtimestamp(self.created).isoformat()
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, content={self.content!r}, timestamp={self.timestamp!r})"
 
 
 @dataclass
@@ -17,40 +58,181 @@ class ChatSession:
     created_at: str
     messages: List[Message] = field(default_factory=list)
 
-    def add_message(self, role: str, content: str):
-        self.messages.append(Message(role=role, content=content))
+    def add_message(self, role: str, content: str) -> Message:
+        message = Message(role=role, content=content)
+        self.messages.append(message)
+        return message
+
+
+@dataclass
+class SessionInfo:
+    created_at: str
+    message_count: int = 0
+    # Bumped on every change, used for conditional GETs
+    version: int = 0
 
 
 class SessionManager:
-    def __init__(self):
-        self.sessions: Dict[str, ChatSession] = {}
+    """Chat sessions with an optional persistent backend.
+
+    Without a store everything lives in memory. With a store, the session
+    list is recovered from it at startup, message history is loaded into the
+    in-memory hot cache when a session is first accessed, and every change is
+    written through to the store.
+
+    The hot cache evicts sessions after ``ttl`` idle seconds and beyond
+    ``max_sessions`` or ``max_bytes``, least recently used first. Evicted
+    sessions are reloaded from the store on next access; without a store
+    they are dropped.
+    """
+
+    def __init__(self, store: SessionStore = None, ttl: float = None,
+                 max_sessions: int = None, max_bytes: int = None):
+        self.store = store
+        # Hot cache of sessions with their messages loaded
+        self.sessions = SessionCache(
+            ttl=ttl,
+            max_sessions=max_sessions,
+            max_bytes=max_bytes,
+            size_of=self._session_size,
+            loader=self._load_session,
+            on_evict=self._evict_session
+        )
+        # Every known session, including those not loaded into the cache
+        self.session_index: Dict[str, SessionInfo] = {}
+        # (created_at, session_id) keys in order, for cursor pagination
+        self._session_order: List[Tuple[str, str]] = []
+        # Versions restart with the process, so tags carry a per-process epoch
+        self.epoch = format(int(time.time() * 1000), "x")
+        self.version = 0
+        # Sessions are touched from both the event loop and the Kafka consumer thread
+        self._lock = threading.RLock()
+
+        if self.store:
+            for session_id, created_at, message_count in self.store.list_sessions():
+                self.session_index[session_id] = SessionInfo(created_at, message_count)
+                self._session_order.append((created_at, session_id))
+            self._session_order.sort()
 
     def create_session(self) -> str:
         session_id = str(uuid.uuid4())
-        self.sessions[session_id] = ChatSession(
-            session_id=session_id,
-            created_at=datetime.now().isoformat()
-        )
+        created_at = datetime.now().isoformat()
+        with self._lock:
+            self.session_index[session_id] = SessionInfo(created_at)
+            bisect.insort(self._session_order, (created_at, session_id))
+            self.version += 1
+            self.sessions[session_id] = ChatSession(
+                session_id=session_id,
+                created_at=created_at
+            )
+        if self.store:
+            self.store.create_session(session_id, created_at)
         return session_id
 
     def get_session(self, session_id: str) -> ChatSession:
-        if session_id not in self.sessions:
+        # The manager lock is always taken before the cache lock
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is None:
             raise ValueError(f"Session {session_id} not found")
-        return self.sessions[session_id]
+        return session
+
+    def evict_expired(self) -> int:
+        with self._lock:
+            return self.sessions.evict_expired()
+
+    def cache_stats(self) -> Dict[str, int]:
+        return self.sessions.stats()
+
+    def _load_session(self, session_id: str) -> Optional[ChatSession]:
+        info = self.session_index.get(session_id)
+        if info is None or not self.store:
+            return None
+
+        return ChatSession(
+            session_id=session_id,
+            created_at=info.created_at,
+            messages=[
+                Message(role=role, content=content, created=created)
+                for role, content, created in self.store.get_messages(session_id)
+            ]
+        )
+
+    def _evict_session(self, session_id: str, session: ChatSession):
+        # With a store every change is already written through
+        if self.store:
+            return
+        info = self.session_index.pop(session_id, None)
+        if info is not None:
+            index = bisect.bisect_left(self._session_order, (info.created_at, session_id))
+            if index < len(self._session_order) and self._session_order[index][1] == session_id:
+                del self._session_order[index]
+            self.version += 1
+
+    @staticmethod
+    def _message_size(content: str) -> int:
+        return len(content) + MESSAGE_OVERHEAD_BYTES
+
+    def _session_size(self, session: ChatSession) -> int:
+        return sum(self._message_size(msg.content) for msg in session.messages)
 
     def get_all_sessions(self) -> List[Dict]:
         return [
             {
-                "session_id": session.session_id,
-                "created_at": session.created_at,
-                "message_count": len(session.messages)
+                "session_id": session_id,
+                "created_at": info.created_at,
+                "message_count": info.message_count
             }
-            for session in self.sessions.values()
+            for session_id, info in self.session_index.items()
         ]
 
+    def get_sessions_page(self, cursor: str = None,
+                          limit: int = None) -> Tuple[Iterator[Dict], Optional[str]]:
+        """Return sessions created after the ``cursor`` session, oldest first.
+
+        The cursor is the session_id of the last session on the previous page.
+        Returns an iterator over the page and the cursor for the next page.
+        """
+        with self._lock:
+            start = 0
+            if cursor:
+                info = self.session_index.get(cursor)
+                if info is None:
+                    raise ValueError(f"Session {cursor} not found")
+                start = bisect.bisect_right(self._session_order, (info.created_at, cursor))
+            end = len(self._session_order) if limit is None else start + limit
+            page = self._session_order[start:end]
+            next_cursor = page[-1][1] if page and end < len(self._session_order) else None
+
+        def iter_page():
+            for _, session_id in page:
+                info = self.session_index.get(session_id)
+                if info is not None:
+                    yield {
+                        "session_id": session_id,
+                        "created_at": info.created_at,
+                        "message_count": info.message_count
+                    }
+
+        return iter_page(), next_cursor
+
+    def get_session_version(self, session_id: str) -> int:
+        info = self.session_index.get(session_id)
+        if info is None:
+            raise ValueError(f"Session {session_id} not found")
+        return info.version
+
     def add_message(self, session_id: str, role: str, content: str):
-        session = self.get_session(session_id)
-        session.add_message(role, content)
+        with self._lock:
+            session = self.get_session(session_id)
+            message = session.add_message(role, content)
+            self.sessions.resize(session_id, self._message_size(content))
+            info = self.session_index[session_id]
+            info.message_count += 1
+            info.version += 1
+            self.version += 1
+            if self.store:
+                self.store.add_message(session_id, role, content, message.created)
 
     def get_messages(self, session_id: str) -> List[Dict]:
         session = self.get_session(session_id)
@@ -62,3 +244,26 @@ class SessionManager:
             }
             for msg in session.messages
         ]
+
+    def get_messages_page(self, session_id: str, cursor: int = 0,
+                          limit: int = None) -> Tuple[Iterator[Dict], Optional[int]]:
+        """Return messages from index ``cursor`` on, with the next page's cursor"""
+        session = self.get_session(session_id)
+        with self._lock:
+            total = len(session.messages)
+            end = total if limit is None else min(cursor + limit, total)
+            page = session.messages[cursor:end]
+
+        def iter_page():
+            for msg in page:
+                yield {
+                    "role": msg.role,
+                    "content": msg.content,
+                    "timestamp": msg.timestamp
+                }
+
+        return iter_page(), end if end < total else None
+
+    def close(self):
+        if self.store:
+            self.store.close()
@@ -0,0 +1,190 @@
+import logging
+import queue
+import sqlite3
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Storage backend interface for SessionManager.
+
+    Backends persist sessions and their messages; SessionManager keeps the
+    hot sessions in memory on top of them.
+    """
+
+    def create_session(self, session_id: str, created_at: str):
+        raise NotImplementedError
+
+    def add_message(self, session_id: str, role: str, content: str, created: float):
+        raise NotImplementedError
+
+    def get_messages(self, session_id: str) -> List[Tuple[str, str, float]]:
+        """Return (role, content, created) tuples in insertion order"""
+        raise NotImplementedError
+
+    def list_sessions(self) -> List[Tuple[str, str, int]]:
+        """Return (session_id, created_at, message_count) tuples ordered by creation"""
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite (WAL mode) session store with batched write-behind.
+
+    ``add_message`` only enqueues the row; a writer thread commits queued rows
+    in batches of up to ``batch_size`` every ``flush_interval`` seconds. The
+    sessions table carries a denormalised message count, so recovering the
+    session list after a restart reads one row per session regardless of
+    how many messages are stored.
+
+    Reads never wait for the writer: messages still queued are kept in an
+    in-memory index per session and appended to what the database returns.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions (created_at);
+        CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id);
+        CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at);
+    """
+
+    def __init__(self, path: str = "chat_sessions.db", batch_size: int = 500,
+                 flush_interval: float = 0.05):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._read_lock = threading.Lock()
+        self._reader = self._connect()
+        self._reader.executescript(self.SCHEMA)
+
+        self._pending = queue.Queue()
+        # Messages queued but not yet committed, per session in insertion order.
+        # The writer commits and removes rows while holding _read_lock, so a
+        # reader holding it sees every row exactly once
+        self._unflushed: Dict[str, Deque[Tuple[str, str, float]]] = {}
+        self._unflushed_lock = threading.Lock()
+        self._running = True
+        self._writer = threading.Thread(target=self._write_behind, daemon=True)
+        self._writer.start()
+        logger.info(f"SQLite session store opened at {path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def create_session(self, session_id: str, created_at: str):
+        self._pending.put(("session", (session_id, created_at)))
+
+    def add_message(self, session_id: str, role: str, content: str, created: float):
+        with self._unflushed_lock:
+            self._unflushed.setdefault(session_id, deque()).append((role, content, created))
+        self._pending.put(("message", (session_id, role, content, created)))
+
+    def get_messages(self, session_id: str) -> List[Tuple[str, str, float]]:
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT role, content, created_at FROM messages WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            ).fetchall()
+            with self._unflushed_lock:
+                rows.extend(self._unflushed.get(session_id, ()))
+        return rows
+
+    def list_sessions(self) -> List[Tuple[str, str, int]]:
+        self.flush()
+        with self._read_lock:
+            return self._reader.execute(
+                "SELECT session_id, created_at, message_count FROM sessions ORDER BY created_at"
+            ).fetchall()
+
+    def flush(self):
+        """Block until every queued write has been committed"""
+        self._pending.join()
+
+    def close(self):
+        self.flush()
+        self._running = False
+        self._pending.put(None)
+        self._writer.join()
+        with self._read_lock:
+            self._reader.close()
+
+    def _write_behind(self):
+        conn = self._connect()
+        while self._running:
+            item = self._pending.get()
+            batch = [item]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._pending.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+
+            entries = [entry for entry in batch if entry is not None]
+            with self._read_lock:
+                try:
+                    self._commit(conn, entries)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} session store entries: {e}")
+                finally:
+                    self._forget_unflushed(entries)
+                    for _ in batch:
+                        self._pending.task_done()
+        conn.close()
+
+    def _forget_unflushed(self, entries: list):
+        with self._unflushed_lock:
+            for kind, args in entries:
+                if kind != "message":
+                    continue
+                rows = self._unflushed.get(args[0])
+                if rows:
+                    rows.popleft()
+                    if not rows:
+                        del self._unflushed[args[0]]
+
+    def _commit(self, conn: sqlite3.Connection, batch: list):
+        sessions = [args for kind, args in batch if kind == "session"]
+        messages = [args for kind, args in batch if kind == "message"]
+
+        counts = {}
+        for session_id, _, _, _ in messages:
+            counts[session_id] = counts.get(session_id, 0) + 1
+
+        with conn:
+            if sessions:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO sessions (session_id, created_at) VALUES (?, ?)",
+                    sessions
+                )
+            if messages:
+                conn.executemany(
+                    "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    messages
+                )
+                conn.executemany(
+                    "UPDATE sessions SET message_count = message_count + ? WHERE session_id = ?",
+                    [(count, session_id) for session_id, count in counts.items()]
+                )
@@ -0,0 +1,80 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class StaticAsset:
+    """A static file held in memory together with its precompressed variants"""
+
+    def __init__(self, path: str, content: bytes, mtime: float):
+        self.path = path
+        self.mtime = mtime
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.digest = hashlib.sha1(content).hexdigest()[:16]
+        self.encodings: Dict[str, bytes] = {"identity": content}
+        self.encodings["gzip"] = gzip.compress(content, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(content)
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        """Strong validator of one representation; each content-coding gets its own"""
+        if encoding is None or encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def negotiate(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """Pick the smallest encoding the client accepts"""
+        accepted = {
+            part.split(";")[0].strip().lower()
+            for part in accept_encoding.split(",")
+            if part.strip() and not part.strip().endswith("q=0")
+        }
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.encodings:
+                return self.encodings[encoding], encoding
+        return self.encodings["identity"], None
+
+
+class StaticCache:
+    """Serves static files from memory.
+
+    Files are read and compressed once. With ``reload`` enabled (dev mode),
+    each lookup checks the file's modification time and reloads it when it
+    changed.
+    """
+
+    def __init__(self, directory: str = "static", reload: bool = False):
+        self.directory = directory
+        self.reload = reload
+        self._assets: Dict[str, StaticAsset] = {}
+        self._lock = threading.Lock()
+
+    def load(self, name: str) -> StaticAsset:
+        path = os.path.join(self.directory, name)
+        mtime = os.stat(path).st_mtime
+        with open(path, "rb") as f:
+            content = f.read()
+        asset = StaticAsset(path, content, mtime)
+        with self._lock:
+            self._assets[name] = asset
+        logger.info(f"Loaded static asset {path} ({len(content)} bytes)")
+        return asset
+
+    def get(self, name: str) -> StaticAsset:
+        asset = self._assets.get(name)
+        if asset is None:
+            return self.load(name)
+        if self.reload and os.stat(asset.path).st_mtime != asset.mtime:
+            return self.load(name)
+        return asset
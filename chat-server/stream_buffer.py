@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Appended to replies that lost chunks, so the stored message says it is incomplete
+TRUNCATED_MARKER = "\n\n[response truncated]"
+
+
+class _Stream:
+    __slots__ = ("chunks", "size", "last_update", "truncated")
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.size = 0
+        self.last_update = time.monotonic()
+        self.truncated = False
+
+
+class StreamBufferPool:
+    """Accumulates streamed response chunks per session.
+
+    Chunks are kept in a list and joined once when the stream finishes, so
+    building a reply costs time and memory linear in its length. Each stream
+    is capped at ``max_session_bytes`` and all streams together at
+    ``max_total_bytes``; streams that receive no chunk for ``idle_timeout``
+    seconds are dropped by ``evict_idle``.
+
+    A stream that loses a chunk is never stored with a gap: once truncated it
+    keeps its prefix and ignores further chunks, and a stream evicted to
+    make room is remembered so that its remaining chunks are ignored rather
+    than starting a new stream. Either way ``finish`` ends the text with
+    ``TRUNCATED_MARKER``.
+
+    The Kafka consumer thread appends while the event loop evicts, so all
+    access goes through a lock.
+    """
+
+    def __init__(self, max_session_bytes: int = 1_000_000,
+                 max_total_bytes: int = 64_000_000, idle_timeout: float = 300.0):
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self.idle_timeout = idle_timeout
+        # Ordered by last update, least recently updated first
+        self._streams: "OrderedDict[str, _Stream]" = OrderedDict()
+        # Sessions whose stream was evicted before it finished, with the time
+        # it was last touched
+        self._evicted: Dict[str, float] = {}
+        self._total_bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def append(self, session_id: str, chunk: str) -> bool:
+        """Add a chunk to the session's stream. Returns False if it was dropped."""
+        size = len(chunk.encode("utf-8"))
+
+        with self._lock:
+            if session_id in self._evicted:
+                self._evicted[session_id] = time.monotonic()
+                return False
+
+            stream = self._streams.get(session_id)
+            if stream is None:
+                stream = self._streams[session_id] = _Stream()
+            else:
+                self._streams.move_to_end(session_id)
+            stream.last_update = time.monotonic()
+
+            if stream.truncated:
+                return False
+            if stream.size + size > self.max_session_bytes:
+                if not stream.truncated:
+                    logger.warning(f"Stream for session {session_id} exceeded {self.max_session_bytes} bytes, truncating")
+                stream.truncated = True
+                return False
+
+            # Make room by dropping the streams that were updated least recently
+            while self._total_bytes + size > self.max_total_bytes:
+                oldest_id = next(iter(self._streams))
+                if oldest_id == session_id:
+                    logger.warning(f"Stream buffers are full, truncating stream for session {session_id}")
+                    stream.truncated = True
+                    return False
+                logger.warning(f"Stream buffers are full, evicting stream for session {oldest_id}")
+                self._evict(oldest_id)
+
+            stream.chunks.append(chunk)
+            stream.size += size
+            self._total_bytes += size
+            return True
+
+    def finish(self, session_id: str) -> str:
+        """Remove the session's stream and return the complete text.
+
+        Incomplete streams end with ``TRUNCATED_MARKER``; an evicted stream
+        returns just the marker.
+        """
+        with self._lock:
+            stream = self._remove(session_id)
+            evicted = self._evicted.pop(session_id, None) is not None
+        if evicted:
+            return TRUNCATED_MARKER.lstrip()
+        if stream is None:
+            return ""
+        text = "".join(stream.chunks)
+        return text + TRUNCATED_MARKER if stream.truncated else text
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._remove(session_id)
+            self._evicted.pop(session_id, None)
+
+    def evict_idle(self) -> int:
+        """Drop streams that have not received a chunk within the idle timeout"""
+        deadline = time.monotonic() - self.idle_timeout
+        evicted = 0
+
+        with self._lock:
+            while self._streams:
+                session_id, stream = next(iter(self._streams.items()))
+                if stream.last_update > deadline:
+                    break
+                self._evict(session_id)
+                evicted += 1
+            # Forget evicted streams that stopped sending too
+            for session_id, touched in list(self._evicted.items()):
+                if touched <= deadline:
+                    del self._evicted[session_id]
+
+        if evicted:
+            logger.info(f"Evicted {evicted} idle stream buffers")
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "streams": len(self._streams),
+                "evicted_streams": len(self._evicted),
+                "bytes": self._total_bytes,
+                "evictions": self._evictions
+            }
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._streams
+
+    def _evict(self, session_id: str):
+        self._remove(session_id)
+        self._evicted[session_id] = time.monotonic()
+        self._evictions += 1
+
+    def _remove(self, session_id: str):
+        stream = self._streams.pop(session_id, None)
+        if stream is not None:
+            self._total_bytes -= stream.size
+        return stream
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Dict, List
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_frame(chunk: str, seq: int = None) -> dict:
+    frame = {"type": "assistant_chunk", "chunk": chunk}
+    if seq is not None:
+        frame["seq"] = seq
+    return frame
+
+
+def done_frame(seq: int = None) -> dict:
+    frame = {"type": "assistant_done"}
+    if seq is not None:
+        frame["seq"] = seq
+    return frame
+
+
+class DeliveryMetrics:
+    """Counts outbound WebSocket frames for the metrics endpoint.
+
+    Rates are computed over fixed windows of ``window_seconds``; the last
+    completed window is reported alongside the running totals.
+    """
+
+    def __init__(self, window_seconds: float = 10.0):
+        self.window_seconds = window_seconds
+        self.frames_total = 0
+        self.bytes_total = 0
+        self.chunks_total = 0
+        self.overflow_merges = 0
+        self.frames_shed = 0
+        self.overflow_disconnects = 0
+        self._window_start = time.monotonic()
+        self._window_frames = 0
+        self._window_bytes = 0
+        self._frames_per_second = 0.0
+        self._bytes_per_frame = 0.0
+
+    def record_frame(self, size: int, chunks: int = 1):
+        self.frames_total += 1
+        self.bytes_total += size
+        self.chunks_total += chunks
+        self._window_frames += 1
+        self._window_bytes += size
+        self._roll()
+
+    def snapshot(self) -> Dict[str, float]:
+        self._roll()
+        return {
+            "frames_total": self.frames_total,
+            "bytes_total": self.bytes_total,
+            "chunks_total": self.chunks_total,
+            "overflow_merges": self.overflow_merges,
+            "frames_shed": self.frames_shed,
+            "overflow_disconnects": self.overflow_disconnects,
+            "frames_per_second": round(self._frames_per_second, 2),
+            "bytes_per_frame": round(self._bytes_per_frame, 2)
+        }
+
+    def _roll(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.window_seconds:
+            return
+        self._frames_per_second = self._window_frames / elapsed
+        self._bytes_per_frame = self._window_bytes / self._window_frames if self._window_frames else 0.0
+        self._window_start = now
+        self._window_frames = 0
+        self._window_bytes = 0
+
+
+class ClientConnection:
+    """Bounded, ordered outbound queue for one WebSocket.
+
+    Frames are queued on the event loop and written by a single writer task,
+    so they reach the client in the order they were queued. At most
+    ``max_queue`` chunk frames may be waiting; when the queue is full the
+    ``overflow`` policy decides what happens to the next chunk:
+
+    - ``coalesce``: merge it into the last queued chunk frame, or queue it
+      anyway when the last queued frame is a control frame (merging across
+      that frame would reorder the stream)
+    - ``close``: disconnect the client, which can reconnect and reload
+    - ``shed``: drop the chunk (the saved message is still complete)
+
+    Control frames (acks, done signals) are always queued. Frames may be
+    queued pre-encoded so a frame fanned out to several connections is only
+    serialised once.
+    """
+
+    OVERFLOW_POLICIES = ("coalesce", "close", "shed")
+
+    def __init__(self, websocket: WebSocket, max_queue: int = 256,
+                 overflow: str = "coalesce", metrics: DeliveryMetrics = None):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.metrics = metrics
+        # Items are [parts, text, chunk_count, seq]: chunk frames hold their
+        # text parts so they can still be merged, other frames only the text
+        self._queue = deque()
+        self._queued_chunk_frames = 0
+        self._wakeup = asyncio.Event()
+        self._writer = None
+        self.closed = False
+
+    def start(self):
+        self._writer = asyncio.get_running_loop().create_task(self._run())
+
+    def send_chunk(self, chunk: str, chunks: int = 1, seq: int = None, text: str = None):
+        """Queue a chunk frame; ``text`` is its already encoded form, if known"""
+        if self.closed:
+            return
+
+        if self._queued_chunk_frames >= self.max_queue:
+            if self.overflow == "coalesce":
+                if self._queue and self._queue[-1][0] is not None:
+                    item = self._queue[-1]
+                    item[0].append(chunk)
+                    item[1] = None
+                    item[2] += chunks
+                    item[3] = seq
+                    self._record("overflow_merges")
+                    return
+                # Queued past the limit; later chunks merge into this frame
+            elif self.overflow == "shed":
+                self._record("frames_shed")
+                return
+            else:
+                logger.warning(f"Outbound queue full ({self.max_queue} frames), disconnecting slow client")
+                self._record("overflow_disconnects")
+                self.close(code=1013)
+                return
+
+        self._queue.append([[chunk], text, chunks, seq])
+        self._queued_chunk_frames += 1
+        self._wakeup.set()
+
+    def send_frame(self, frame: dict):
+        self.send_encoded(json.dumps(frame))
+
+    def send_encoded(self, text: str):
+        if self.closed:
+            return
+        self._queue.append([None, text, 0, None])
+        self._wakeup.set()
+
+    def close(self, code: int = None):
+        """Stop the writer; with a close code, also close the WebSocket"""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._queued_chunk_frames = 0
+        if self._writer is not None:
+            self._writer.cancel()
+        if code is not None:
+            asyncio.get_running_loop().create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception as e:
+            logger.debug(f"Error closing WebSocket: {e}")
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            parts, text, count, seq = self._queue.popleft()
+            if parts is not None:
+                self._queued_chunk_frames -= 1
+                if text is None:
+                    text = json.dumps(chunk_frame("".join(parts), seq))
+
+            try:
+                await self.websocket.send_text(text)
+            except Exception as e:
+                # The socket is gone; drop the rest of the queue
+                logger.error(f"Failed to send streaming message via WebSocket, closing connection: {e}")
+                self.close()
+                return
+
+            if self.metrics:
+                self.metrics.record_frame(len(text), count)
+
+    def _record(self, counter: str):
+        if self.metrics:
+            setattr(self.metrics, counter, getattr(self.metrics, counter) + 1)
+
+
+class ChunkCoalescer:
+    """Merges streamed chunks for one session into fewer WebSocket frames.
+
+    Chunks arriving within ``window`` seconds of the first pending chunk are
+    passed on to ``target`` as a single ``assistant_chunk`` frame, or earlier
+    once ``max_bytes`` are pending. Frames keep the existing client protocol;
+    only the number of frames changes. All methods must be called on the
+    event loop.
+    """
+
+    def __init__(self, target: "SessionChannel", window: float = 0.02,
+                 max_bytes: int = 4096):
+        self.target = target
+        self.window = window
+        self.max_bytes = max_bytes
+        self._pending: List[str] = []
+        self._pending_bytes = 0
+        self._pending_seq = None
+        self._timer = None
+
+    def add_chunk(self, chunk: str, seq: int = None):
+        self._pending.append(chunk)
+        self._pending_bytes += len(chunk)
+        self._pending_seq = seq
+
+        if self._pending_bytes >= self.max_bytes:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def finish(self, seq: int = None):
+        """Flush pending chunks and signal the end of the stream"""
+        self.flush()
+        self.target.send_frame(done_frame(seq))
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        chunks = len(self._pending)
+        chunk = "".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        self.target.send_chunk(chunk, chunks, self._pending_seq)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = []
+        self._pending_bytes = 0
+
+
+class SessionChannel:
+    """Fans streamed frames for one session out to all of its WebSockets.
+
+    Chunks are coalesced once per session and every frame is encoded once;
+    the same text is then queued on each subscribed connection. Connections
+    may subscribe or unsubscribe while a stream is in flight: the subscriber
+    tuple is replaced rather than mutated, and a connection that joins
+    mid-stream receives the chunks from that point on. All methods must be
+    called on the event loop.
+    """
+
+    def __init__(self, window: float = 0.02, max_bytes: int = 4096):
+        self.subscribers = ()
+        self.coalescer = ChunkCoalescer(self, window=window, max_bytes=max_bytes)
+
+    def subscribe(self, connection: ClientConnection):
+        self.subscribers = self.subscribers + (connection,)
+
+    def unsubscribe(self, connection: ClientConnection):
+        self.subscribers = tuple(c for c in self.subscribers if c is not connection)
+
+    def add_chunk(self, chunk: str, seq: int = None):
+        self.coalescer.add_chunk(chunk, seq)
+
+    def finish(self, seq: int = None):
+        self.coalescer.finish(seq)
+
+    def flush(self):
+        self.coalescer.flush()
+
+    def send_chunk(self, chunk: str, chunks: int = 1, seq: int = None):
+        text = json.dumps(chunk_frame(chunk, seq))
+        for connection in self.subscribers:
+            connection.send_chunk(chunk, chunks, seq, text)
+
+    def send_frame(self, frame: dict):
+        text = json.dumps(frame)
+        for connection in self.subscribers:
+            connection.send_encoded(text)
+
+    def close(self):
+        self.coalescer.close()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Check that the modules copied between services are still identical.
+
+Run from the repository root; exits non-zero when a copy has drifted.
+"""
+import filecmp
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SHARED_MODULES = {
+    "wire_format.py": ["chat-server", "workflow-orchestrator"],
+    "session_cache.py": ["chat-server", "conversational-workflow"],
+}
+
+
+def main():
+    drifted = []
+    for module, services in SHARED_MODULES.items():
+        paths = [os.path.join(ROOT, service, module) for service in services]
+        first = paths[0]
+        for other in paths[1:]:
+            if not filecmp.cmp(first, other, shallow=False):
+                drifted.append((os.path.relpath(first, ROOT), os.path.relpath(other, ROOT)))
+
+    for first, other in drifted:
+        print(f"{first} and {other} differ")
+    if drifted:
+        return 1
+    print(f"{len(SHARED_MODULES)} shared modules identical")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,15 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Dict, List, Optional
 import logging
 import os
 import json
 from dotenv import load_dotenv
 from workflow import ConversationalWorkflow
+from history import HistoryEntry
+from history_store import HistoryStore
+from response_cache import ResponseCache, ResponseCacheStore
 
 # Load environment variables
 load_dotenv()
@@ -21,10 +25,27 @@ app = FastAPI(title="Conversational Workflow Service")
 # Initialize workflow
 workflow = None
 
+# Routes listed in RESPONSE_CACHE_BYPASS (comma separated, e.g. "/chat") never
+# use the response cache
+RESPONSE_CACHE_BYPASS = {
+    route.strip() for route in os.getenv("RESPONSE_CACHE_BYPASS", "").split(",") if route.strip()
+}
+
 
 class ChatRequest(BaseModel):
     session_id: str
     message: str
+    # Set by the orchestrator on hedged requests: the turn is not recorded
+    # (the orchestrator records the answer it keeps through
+    # /sessions/{session_id}/turns), and a replica other than the session's
+    # own answers with the history sent along
+    record_turn: bool = True
+    history: Optional[List[Dict[str, str]]] = None
+
+
+class TurnRequest(BaseModel):
+    message: str
+    response: str
 
 
 class ChatResponse(BaseModel):
@@ -41,21 +62,61 @@ async def startup_event():
         logger.error("OPENAI_API_KEY not found in environment variables")
         raise ValueError("OPENAI_API_KEY is required")
 
-    workflow = ConversationalWorkflow(api_key=api_key)
+    # Evicted histories are offloaded to SQLite when HISTORY_DB_PATH is set
+    history_db_path = os.getenv("HISTORY_DB_PATH")
+
+    # Identical prompts are answered from the response cache; RESPONSE_CACHE_DB_PATH
+    # adds an SQLite tier that survives restarts
+    response_cache = None
+    if os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1":
+        response_cache_db_path = os.getenv("RESPONSE_CACHE_DB_PATH")
+        response_cache = ResponseCache(
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+            max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            store=ResponseCacheStore(response_cache_db_path) if response_cache_db_path else None
+        )
+
+    workflow = ConversationalWorkflow(
+        api_key=api_key,
+        history_store=HistoryStore(history_db_path) if history_db_path else None,
+        history_ttl=float(os.getenv("HISTORY_TTL", "3600")),
+        max_sessions=int(os.getenv("HISTORY_MAX_SESSIONS", "10000")),
+        max_bytes=int(os.getenv("HISTORY_MAX_BYTES", str(256 * 1024 * 1024))),
+        response_cache=response_cache
+    )
     logger.info("Conversational Workflow Service started successfully")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if workflow and workflow.response_cache:
+        workflow.response_cache.close()
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "conversational-workflow"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "session_cache": workflow.session_histories.stats(),
+        "response_cache": workflow.response_cache.stats() if workflow.response_cache else None
+    }
+
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     logger.info(f"Received chat request for session {request.session_id}")
 
     try:
-        response = workflow.process_message(request.session_id, request.message)
+        response = workflow.process_message(
+            request.session_id,
+            request.message,
+            use_cache="/chat" not in RESPONSE_CACHE_BYPASS
+        )
 
         return ChatResponse(
             session_id=request.session_id,
@@ -72,9 +133,22 @@ async def chat_stream(request: ChatRequest):
     """Stream chat responses in real-time"""
     logger.info(f"Received streaming chat request for session {request.session_id}")
 
+    history = None
+    if request.history is not None:
+        try:
+            history = [HistoryEntry.from_dict(entry) for entry in request.history]
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid history entry: {e}")
+
     async def generate():
         try:
-            async for chunk in workflow.process_message_stream(request.session_id, request.message):
+            async for chunk in workflow.process_message_stream(
+                request.session_id,
+                request.message,
+                use_cache="/chat/stream" not in RESPONSE_CACHE_BYPASS,
+                record_turn=request.record_turn,
+                history=history
+            ):
                 # Send each chunk as JSON
                 yield json.dumps({"chunk": chunk}) + "\n"
         except Exception as e:
@@ -84,6 +158,30 @@ async def chat_stream(request: ChatRequest):
     return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 
+@app.post("/sessions/{session_id}/cancel")
+async def cancel_stream(session_id: str):
+    """Stop the session's in-progress streaming answer"""
+    cancelled = workflow.cancel_stream(session_id)
+    if cancelled:
+        logger.info(f"Cancelled stream for session {session_id}")
+    return {"session_id": session_id, "cancelled": cancelled}
+
+
+@app.get("/sessions/{session_id}/history")
+async def get_history(session_id: str):
+    """The session's chat history, which the orchestrator sends along with
+    hedged requests to other replicas"""
+    history = workflow.session_histories.get(session_id) or []
+    return {"session_id": session_id, "history": [entry.to_dict() for entry in history]}
+
+
+@app.post("/sessions/{session_id}/turns")
+async def append_turn(session_id: str, turn: TurnRequest):
+    """Record a turn answered by a hedged request"""
+    workflow.append_turn(session_id, turn.message, turn.response)
+    return {"session_id": session_id}
+
+
 @app.delete("/sessions/{session_id}")
 async def clear_session(session_id: str):
     try:
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Measure in-memory bytes per chat history message, before and after the
+compact HistoryEntry representation
+"""
+import tracemalloc
+
+from history import HistoryEntry, USER, ASSISTANT
+
+MESSAGES = 100_000
+
+
+def measure(factory, contents):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    history = [factory(i % 2 == 0, content) for i, content in enumerate(contents)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(history), history
+
+
+def main():
+    # Content strings are allocated up front so only the overhead is measured
+    contents = [f"message {i}" for i in range(MESSAGES)]
+
+    legacy, _ = measure(
+        lambda is_user, content: {"role": "user" if is_user else "assistant", "content": content},
+        contents
+    )
+    compact, _ = measure(
+        lambda is_user, content: HistoryEntry(USER if is_user else ASSISTANT, content),
+        contents
+    )
+
+    print("=" * 60)
+    print(f"HISTORY MEMORY ({MESSAGES} messages, content excluded)")
+    print("=" * 60)
+    print(f"  role/content dict:    {legacy:8.1f} bytes/message")
+    print(f"  slotted HistoryEntry: {compact:8.1f} bytes/message")
+    print(f"  reduction:            {100 * (1 - compact / legacy):8.1f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Measure the per-turn cost of preparing the LLM message list as a
+conversation grows, rebuilding it from the history on every turn versus
+appending to the cached prepared list
+"""
+import time
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+import prepared_messages
+from history import HistoryEntry, USER, ASSISTANT
+
+TURNS = 1000
+CHECKPOINTS = (10, 100, 250, 500, 1000)
+SYSTEM_MESSAGE = SystemMessage(content="You are a helpful AI assistant.")
+
+
+def rebuild_turn(history, messages, message, response):
+    """Previous behaviour: a fresh message object per history entry every turn"""
+    prepared = prepared_messages.build_messages(SYSTEM_MESSAGE, history)
+    prepared.append(HumanMessage(content=message))
+    return prepared, messages
+
+
+def incremental_turn(history, messages, message, response):
+    prepared = [*messages, HumanMessage(content=message)]
+    prepared_messages.append_turn(messages, message, response)
+    return prepared, messages
+
+
+def run(prepare_turn):
+    """Return the average prep time (µs) of the turns just before each checkpoint"""
+    history = []
+    messages = [SYSTEM_MESSAGE]
+    timings = {}
+    window = []
+    for turn in range(1, TURNS + 1):
+        message, response = f"question {turn}", f"answer {turn}"
+        started = time.perf_counter()
+        prepare_turn(history, messages, message, response)
+        window.append(time.perf_counter() - started)
+
+        history.append(HistoryEntry(USER, message))
+        history.append(HistoryEntry(ASSISTANT, response))
+        if turn in CHECKPOINTS:
+            recent = window[-10:]
+            timings[turn] = 1e6 * sum(recent) / len(recent)
+    return timings
+
+
+def main():
+    rebuild = run(rebuild_turn)
+    incremental = run(incremental_turn)
+
+    print("=" * 60)
+    print("MESSAGE PREPARATION COST PER TURN (avg of the last 10 turns)")
+    print("=" * 60)
+    print(f"  {'turn':>6} {'history':>8} {'rebuild':>12} {'incremental':>12}")
+    for turn in CHECKPOINTS:
+        print(f"  {turn:>6} {2 * (turn - 1):>8} {rebuild[turn]:>10.1f}us {incremental[turn]:>10.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+from typing import Dict, List
+
+# Roles are stored as small integer codes
+USER = 0
+ASSISTANT = 1
+ROLES = ("user", "assistant")
+ROLE_CODES: Dict[str, int] = {role: code for code, role in enumerate(ROLES)}
+
+
+class HistoryEntry:
+    """One message of a session's chat history, stored as a slotted record
+    with an interned role code"""
+
+    __slots__ = ("role_code", "content")
+
+    def __init__(self, role_code: int, content: str):
+        self.role_code = role_code
+        self.content = content
+
+    @property
+    def role(self) -> str:
+        return ROLES[self.role_code]
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, str]) -> "HistoryEntry":
+        return cls(ROLE_CODES[data["role"]], data["content"])
+
+    def __repr__(self):
+        return f"HistoryEntry(role={self.role!r}, content={self.content!r})"
+
+
+def history_size(history: List[HistoryEntry]) -> int:
+    """Approximate memory used by a history, for cache accounting"""
+    return sum(len(entry.content) for entry in history) + 100 * len(history)
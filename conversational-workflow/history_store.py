@@ -0,0 +1,47 @@
+import json
+import logging
+import sqlite3
+import threading
+from typing import List, Optional
+from history import HistoryEntry
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryStore:
+    """SQLite store for chat histories evicted from memory"""
+
+    def __init__(self, path: str = "session_histories.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS histories (session_id TEXT PRIMARY KEY, history TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        logger.info(f"History store opened at {path}")
+
+    def save(self, session_id: str, history: List[HistoryEntry]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO histories (session_id, history) VALUES (?, ?)",
+                (session_id, json.dumps([entry.to_dict() for entry in history]))
+            )
+
+    def load(self, session_id: str) -> Optional[List[HistoryEntry]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history FROM histories WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return [HistoryEntry.from_dict(data) for data in json.loads(row[0])]
+
+    def delete(self, session_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM histories WHERE session_id = ?", (session_id,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,35 @@
+from typing import List
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from history import HistoryEntry, USER
+
+
+def to_message(entry: HistoryEntry) -> BaseMessage:
+    if entry.role_code == USER:
+        return HumanMessage(content=entry.content)
+    return AIMessage(content=entry.content)
+
+
+def build_messages(system_message: SystemMessage, history: List[HistoryEntry]) -> List[BaseMessage]:
+    """Full LLM message list for a history: the system message, then one
+    message per history entry"""
+    messages = [system_message]
+    messages.extend(to_message(entry) for entry in history)
+    return messages
+
+
+def in_sync(messages: List[BaseMessage], history: List[HistoryEntry]) -> bool:
+    """Whether a prepared list still matches its history (both are append-only,
+    so equal lengths mean equal contents)"""
+    return len(messages) == len(history) + 1
+
+
+def append_turn(messages: List[BaseMessage], message: str, response: str):
+    messages.append(HumanMessage(content=message))
+    messages.append(AIMessage(content=response))
+
+
+def messages_size(messages: List[BaseMessage]) -> int:
+    """Approximate memory used by a prepared list, for cache accounting"""
+    return sum(len(message.content) for message in messages) + 500 * len(messages)
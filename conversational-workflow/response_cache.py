@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+from history import HistoryEntry
+from session_cache import SessionCache
+
+logger = logging.getLogger(__name__)
+
+# Fixed per-entry overhead used for the cache's byte limit
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize(text: str) -> str:
+    """Case- and whitespace-insensitive form of a prompt used for cache keys"""
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(system_prompt: str, history: List[HistoryEntry], message: str, model: str = "") -> str:
+    """Hash of everything the LLM sees for a turn"""
+    digest = hashlib.sha256()
+    for part in (model, system_prompt):
+        digest.update(normalize(part).encode("utf-8"))
+        digest.update(b"\0")
+    for entry in history:
+        digest.update(bytes((entry.role_code,)))
+        digest.update(normalize(entry.content).encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(normalize(message).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def replay_chunks(text: str, size: int = 32) -> Iterator[str]:
+    """Split a cached response into stream chunks"""
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+class CachedResponse:
+    """A cached LLM response and how long it originally took to produce"""
+
+    __slots__ = ("response", "latency", "created")
+
+    def __init__(self, response: str, latency: float, created: float = None):
+        self.response = response
+        self.latency = latency
+        self.created = created if created is not None else time.time()
+
+
+class ResponseCacheStore:
+    """SQLite tier for cached responses, shared across restarts"""
+
+    def __init__(self, path: str = "response_cache.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, latency REAL NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+        logger.info(f"Response cache store opened at {path}")
+
+    def save(self, key: str, entry: CachedResponse):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, latency, created) VALUES (?, ?, ?, ?)",
+                (key, entry.response, entry.latency, entry.created)
+            )
+
+    def load(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, latency, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedResponse(*row)
+
+    def delete_older_than(self, created: float) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM responses WHERE created < ?", (created,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """LLM response cache with an in-memory LRU tier and an optional disk tier.
+
+    Entries expire ``ttl`` seconds after they were created. The memory tier
+    is a SessionCache bounded by ``max_entries`` and ``max_bytes``; with a
+    ``store``, responses are also written to it and memory misses are looked
+    up there.
+
+    The disk tier never runs on the event loop: writes are queued to a
+    single writer thread, and ``aget`` looks up memory misses in the
+    loop's executor. ``get`` looks them up in the calling thread, for the
+    synchronous graph path.
+    """
+
+    # Expired rows are purged from the store every this many writes
+    PURGE_INTERVAL = 1000
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024, store: ResponseCacheStore = None):
+        self.ttl = ttl
+        self.store = store
+        self.memory = SessionCache(
+            ttl=ttl,
+            max_sessions=max_entries,
+            max_bytes=max_bytes,
+            size_of=lambda entry: len(entry.response) + ENTRY_OVERHEAD_BYTES
+        )
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0
+        self._writes = 0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache") if store else None
+
+    def _load(self, key: str) -> Optional[CachedResponse]:
+        try:
+            entry = self.store.load(key)
+        except Exception as e:
+            logger.error(f"Failed to read response cache entry: {e}")
+            return None
+        if entry is not None and not self._expired(entry):
+            return entry
+        return None
+
+    def _expired(self, entry: CachedResponse) -> bool:
+        return time.time() - entry.created >= self.ttl
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._get_memory(key)
+        if entry is None and self.store is not None:
+            entry = self._promote(key, self._load(key))
+        return self._count(entry)
+
+    async def aget(self, key: str) -> Optional[CachedResponse]:
+        """Like ``get``, with the disk lookup run in the loop's executor"""
+        entry = self._get_memory(key)
+        if entry is None and self.store is not None:
+            loaded = await asyncio.get_running_loop().run_in_executor(None, self._load, key)
+            entry = self._promote(key, loaded)
+        return self._count(entry)
+
+    def _get_memory(self, key: str) -> Optional[CachedResponse]:
+        entry = self.memory.get(key)
+        if entry is not None and self._expired(entry):
+            self.memory.pop(key)
+            return None
+        return entry
+
+    def _promote(self, key: str, entry: Optional[CachedResponse]) -> Optional[CachedResponse]:
+        if entry is not None:
+            self.disk_hits += 1
+            self.memory.set(key, entry)
+        return entry
+
+    def _count(self, entry: Optional[CachedResponse]) -> Optional[CachedResponse]:
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_seconds += entry.latency
+        return entry
+
+    def put(self, key: str, response: str, latency: float):
+        entry = CachedResponse(response, latency)
+        self.memory.set(key, entry)
+        if self.store is not None:
+            self._writer.submit(self._save, key, entry)
+
+    def _save(self, key: str, entry: CachedResponse):
+        # Runs on the writer thread
+        try:
+            self.store.save(key, entry)
+            self._writes += 1
+            if self._writes % self.PURGE_INTERVAL == 0:
+                self.store.delete_older_than(time.time() - self.ttl)
+        except Exception as e:
+            logger.error(f"Failed to write response cache entry: {e}")
+
+    def close(self):
+        """Finish queued writes and close the store"""
+        if self.store is None:
+            return
+        self._writer.shutdown(wait=True)
+        self.store.close()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        memory = self.memory.stats()
+        return {
+            "entries": memory["sessions"],
+            "bytes": memory["bytes"],
+            "evictions": memory["evictions"],
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3)
+        }
@@ -1,23 +1,41 @@
+import asyncio
 import logging
-from typing import TypedDict, List, Dict
+from typing import Dict, TypedDict, List
 from langgraph.graph import StateGraph, END
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 import os
+import time
+from session_cache import SessionCache
+from history_store import HistoryStore
+from history import HistoryEntry, USER, ASSISTANT, history_size
+from response_cache import ResponseCache, cache_key, replay_chunks
+import prepared_messages
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "You are a helpful AI assistant. Provide clear, concise, and friendly responses."
+
+# Shared by every session's prepared message list
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+FALLBACK_RESPONSE = "I apologize, but I'm having trouble processing your request right now."
+
 
 class ConversationState(TypedDict):
     session_id: str
     message: str
-    chat_history: List[Dict[str, str]]
+    chat_history: List[HistoryEntry]
+    messages: List[BaseMessage]
     response: str
+    use_cache: bool
 
 
 class ConversationalWorkflow:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, history_store: HistoryStore = None,
+                 history_ttl: float = None, max_sessions: int = None, max_bytes: int = None,
+                 response_cache: ResponseCache = None):
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key is required")
@@ -29,7 +47,79 @@ class ConversationalWorkflow:
         )
 
         self.graph = self._build_graph()
-        self.session_histories: Dict[str, List[Dict[str, str]]] = {}
+
+        # Chat histories are evicted after being idle for history_ttl seconds or
+        # when over the session/byte limits, and offloaded to the history store
+        # if one is configured
+        self.history_store = history_store
+        self.session_histories = SessionCache(
+            ttl=history_ttl,
+            max_sessions=max_sessions,
+            max_bytes=max_bytes,
+            size_of=history_size,
+            loader=history_store.load if history_store else None,
+            on_evict=history_store.save if history_store else None
+        )
+
+        # Responses for identical prompts (same system prompt, history and
+        # message) are served from the cache instead of calling OpenAI
+        self.response_cache = response_cache
+
+        # LLM message lists per session, kept in step with the histories so a
+        # turn only appends to them instead of rebuilding the whole list. They
+        # are derived data: evicted lists are rebuilt from the history.
+        self.prepared_messages = SessionCache(
+            ttl=history_ttl,
+            max_sessions=max_sessions,
+            max_bytes=max_bytes,
+            size_of=prepared_messages.messages_size
+        )
+
+        # Set to stop the session's LLM stream (see cancel_stream)
+        self.cancel_events: Dict[str, asyncio.Event] = {}
+
+    def get_history(self, session_id: str) -> List[HistoryEntry]:
+        """Get or initialize chat history for a session"""
+        history = self.session_histories.get(session_id)
+        if history is None:
+            history = []
+            self.session_histories[session_id] = history
+        return history
+
+    def get_messages(self, session_id: str, history: List[HistoryEntry]) -> List[BaseMessage]:
+        """LLM messages for a session's history, system message first.
+
+        The list is cached and only rebuilt when missing or out of step with
+        the history; callers must not modify it.
+        """
+        messages = self.prepared_messages.get(session_id)
+        if messages is None or not prepared_messages.in_sync(messages, history):
+            messages = prepared_messages.build_messages(SYSTEM_MESSAGE, history)
+            self.prepared_messages[session_id] = messages
+        return messages
+
+    def append_turn(self, session_id: str, message: str, response: str):
+        history = self.get_history(session_id)
+        messages = self.prepared_messages.get(session_id)
+        if messages is not None:
+            if prepared_messages.in_sync(messages, history):
+                prepared_messages.append_turn(messages, message, response)
+                self.prepared_messages.resize(session_id, len(message) + len(response) + 1000)
+            else:
+                self.prepared_messages.pop(session_id)
+
+        history.append(HistoryEntry(USER, message))
+        history.append(HistoryEntry(ASSISTANT, response))
+        self.session_histories.resize(session_id, len(message) + len(response) + 200)
+
+    def _cache_key(self, history: List[HistoryEntry], message: str, use_cache: bool):
+        """Response cache key for a turn, or None when the cache is not used"""
+        if self.response_cache is None:
+            return None
+        if not use_cache:
+            self.response_cache.bypassed += 1
+            return None
+        return cache_key(SYSTEM_PROMPT, history, message, self.llm.model_name)
 
     def _build_graph(self):
         workflow = StateGraph(ConversationState)
@@ -50,42 +140,37 @@ class ConversationalWorkflow:
     def prepare_messages(self, state: ConversationState) -> ConversationState:
         session_id = state["session_id"]
 
-        # Get or initialize chat history for this session
-        if session_id not in self.session_histories:
-            self.session_histories[session_id] = []
-
-        state["chat_history"] = self.session_histories[session_id]
+        state["chat_history"] = self.get_history(session_id)
+        state["messages"] = self.get_messages(session_id, state["chat_history"])
         logger.info(f"Prepared messages for session {session_id}")
 
         return state
 
     def call_llm(self, state: ConversationState) -> ConversationState:
-        logger.info(f"Calling OpenAI LLM for session {state['session_id']}")
-
-        # Build messages for LLM
-        messages = [
-            SystemMessage(content="You are a helpful AI assistant. Provide clear, concise, and friendly responses.")
-        ]
+        key = self._cache_key(state["chat_history"], state["message"], state.get("use_cache", True))
+        cached = self.response_cache.get(key) if key else None
+        if cached is not None:
+            logger.info(f"Serving cached response for session {state['session_id']}")
+            state["response"] = cached.response
+            return state
 
-        # Add chat history
-        for msg in state["chat_history"]:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            else:
-                messages.append(AIMessage(content=msg["content"]))
+        logger.info(f"Calling OpenAI LLM for session {state['session_id']}")
 
-        # Add current message
-        messages.append(HumanMessage(content=state["message"]))
+        # Prepared history messages plus the current message
+        messages = [*state["messages"], HumanMessage(content=state["message"])]
 
         try:
             # Call LLM
+            started = time.monotonic()
             response = self.llm.invoke(messages)
             state["response"] = response.content
             logger.info(f"Received response from OpenAI for session {state['session_id']}")
+            if key and response.content:
+                self.response_cache.put(key, response.content, time.monotonic() - started)
 
         except Exception as e:
             logger.error(f"Error calling OpenAI: {e}")
-            state["response"] = "I apologize, but I'm having trouble processing your request right now."
+            state["response"] = FALLBACK_RESPONSE
 
         return state
 
@@ -93,24 +178,19 @@ class ConversationalWorkflow:
         session_id = state["session_id"]
 
         # Update chat history
-        self.session_histories[session_id].append({
-            "role": "user",
-            "content": state["message"]
-        })
-        self.session_histories[session_id].append({
-            "role": "assistant",
-            "content": state["response"]
-        })
+        self.append_turn(session_id, state["message"], state["response"])
 
         logger.info(f"Formatted response for session {session_id}")
         return state
 
-    def process_message(self, session_id: str, message: str) -> str:
+    def process_message(self, session_id: str, message: str, use_cache: bool = True) -> str:
         initial_state = ConversationState(
             session_id=session_id,
             message=message,
             chat_history=[],
-            response=""
+            messages=[],
+            response="",
+            use_cache=use_cache
         )
 
         logger.info(f"Processing message for session {session_id}")
@@ -118,56 +198,98 @@ class ConversationalWorkflow:
 
         return final_state["response"]
 
-    async def process_message_stream(self, session_id: str, message: str):
-        """Process message with streaming response"""
-        logger.info(f"Processing streaming message for session {session_id}")
-
-        # Get or initialize chat history for this session
-        if session_id not in self.session_histories:
-            self.session_histories[session_id] = []
+    async def process_message_stream(self, session_id: str, message: str, use_cache: bool = True,
+                                     record_turn: bool = True, history: List[HistoryEntry] = None):
+        """Process message with streaming response.
 
-        chat_history = self.session_histories[session_id]
-
-        # Build messages for LLM
-        messages = [
-            SystemMessage(content="You are a helpful AI assistant. Provide clear, concise, and friendly responses.")
-        ]
-
-        # Add chat history
-        for msg in chat_history:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            else:
-                messages.append(AIMessage(content=msg["content"]))
-
-        # Add current message
-        messages.append(HumanMessage(content=message))
+        ``history`` answers with the given chat history instead of the
+        session's own, and with ``record_turn`` False the turn is left out of
+        the session's history. The orchestrator's hedged requests use both:
+        it records the answer it keeps through ``append_turn`` instead.
+        """
+        logger.info(f"Processing streaming message for session {session_id}")
 
+        chat_history = self.get_history(session_id) if history is None else history
+
+        key = self._cache_key(chat_history, message, use_cache)
+        cached = await self.response_cache.aget(key) if key else None
+        if cached is not None:
+            # Replay in chunks so callers see the same stream as for a live answer
+            logger.info(f"Streaming cached response for session {session_id}")
+            replayed = ""
+            try:
+                for chunk in replay_chunks(cached.response):
+                    # Counted before the yield, as for a live answer
+                    replayed += chunk
+                    yield chunk
+            finally:
+                # Like a live answer, a disconnect keeps what was sent so far
+                if record_turn and replayed:
+                    self.append_turn(session_id, message, replayed)
+            return
+
+        # Prepared history messages plus the current message
+        if history is None:
+            messages = [*self.get_messages(session_id, chat_history), HumanMessage(content=message)]
+        else:
+            messages = [*prepared_messages.build_messages(SYSTEM_MESSAGE, history), HumanMessage(content=message)]
+
+        cancel = self.cancel_events[session_id] = asyncio.Event()
+        stream = self.llm.astream(messages)
+        started = time.monotonic()
+        full_response = ""
+        # The turn is recorded however the stream ends: a cancelled answer
+        # (cancel endpoint or client disconnect) is kept as far as it got
+        # but never cached, and a failed one is recorded as the fallback. An
+        # answer cancelled before its first token is not recorded at all.
+        failed = False
         try:
             # Stream from LLM
-            full_response = ""
-            async for chunk in self.llm.astream(messages):
+            async for chunk in stream:
+                if cancel.is_set():
+                    break
                 if chunk.content:
                     full_response += chunk.content
                     yield chunk.content
 
-            # Update chat history after streaming completes
-            self.session_histories[session_id].append({
-                "role": "user",
-                "content": message
-            })
-            self.session_histories[session_id].append({
-                "role": "assistant",
-                "content": full_response
-            })
+            if cancel.is_set():
+                logger.info(f"Cancelled streaming response for session {session_id}")
+                return
+            if key and full_response:
+                self.response_cache.put(key, full_response, time.monotonic() - started)
 
             logger.info(f"Completed streaming response for session {session_id}")
 
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client disconnected; stop the LLM stream
+            logger.info(f"Client disconnected, stopped streaming for session {session_id}")
+            raise
+
         except Exception as e:
             logger.error(f"Error in streaming: {e}")
-            yield f"I apologize, but I'm having trouble processing your request right now."
+            failed = True
+            yield FALLBACK_RESPONSE
+
+        finally:
+            response = FALLBACK_RESPONSE if failed else full_response
+            if record_turn and response:
+                self.append_turn(session_id, message, response)
+            # Closes the OpenAI stream right away when stopping early
+            await stream.aclose()
+            if self.cancel_events.get(session_id) is cancel:
+                del self.cancel_events[session_id]
+
+    def cancel_stream(self, session_id: str) -> bool:
+        """Stop the session's in-progress LLM stream; returns False if there is none"""
+        cancel = self.cancel_events.get(session_id)
+        if cancel is None:
+            return False
+        cancel.set()
+        return True
 
     def clear_session(self, session_id: str):
-        if session_id in self.session_histories:
-            del self.session_histories[session_id]
+        if self.history_store:
+            self.history_store.delete(session_id)
+        self.prepared_messages.pop(session_id)
+        if self.session_histories.pop(session_id) is not None:
             logger.info(f"Cleared history for session {session_id}")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Check SessionTaskPool admission and scheduling with simulated jobs: a burst
+from one tenant must not delay a quiet session behind it, and each session's
+jobs must run one at a time in the order they were submitted
+"""
+import asyncio
+import random
+import sys
+import time
+
+from session_pool import SessionTaskPool
+
+JOB_SECONDS = 0.005
+
+
+async def burst_vs_quiet():
+    """One tenant floods the pool across many sessions, then a quiet session
+    sends a few messages; returns completion ranks and queue waits per flow"""
+    pool = SessionTaskPool(concurrency=4, max_pending=40, max_pending_per_flow=4, max_held=400)
+    finished = []
+    submitted = {}
+    waits = {"burst": [], "quiet": []}
+
+    def make_job(flow, index):
+        async def job():
+            waits[flow].append(time.monotonic() - submitted[(flow, index)])
+            await asyncio.sleep(JOB_SECONDS)
+            finished.append(flow)
+        return job
+
+    done = asyncio.Event()
+    total = 200 + 10
+
+    def on_done():
+        if len(finished) == total:
+            done.set()
+
+    for index in range(200):
+        submitted[("burst", index)] = time.monotonic()
+        await pool.submit(f"burst-{index % 20}", make_job("burst", index), on_done, tenant="burst")
+    for index in range(10):
+        submitted[("quiet", index)] = time.monotonic()
+        await pool.submit("quiet", make_job("quiet", index), on_done)
+    await done.wait()
+
+    quiet_ranks = [rank for rank, flow in enumerate(finished) if flow == "quiet"]
+    return quiet_ranks, waits
+
+
+async def session_order(sessions=50, jobs=2000, tenants=5, seed=1):
+    """Random jobs across tenants and sessions; returns per-session order
+    violations and overlapping jobs"""
+    rng = random.Random(seed)
+    pool = SessionTaskPool(concurrency=16, max_pending=100, max_pending_per_flow=10, max_held=50)
+    runs = {}
+    running = set()
+    overlaps = 0
+    done = asyncio.Event()
+    completed = 0
+
+    def make_job(session_id, index):
+        async def job():
+            nonlocal overlaps
+            if session_id in running:
+                overlaps += 1
+            running.add(session_id)
+            runs.setdefault(session_id, []).append(index)
+            await asyncio.sleep(rng.random() * JOB_SECONDS)
+            running.discard(session_id)
+        return job
+
+    def on_done():
+        nonlocal completed
+        completed += 1
+        if completed == jobs:
+            done.set()
+
+    for index in range(jobs):
+        session = rng.randrange(sessions)
+        tenant = f"tenant-{session % tenants}" if session % 3 else None
+        priority = "batch" if rng.random() < 0.2 else "interactive"
+        await pool.submit(f"session-{session}", make_job(f"session-{session}", index), on_done,
+                          tenant=tenant, priority=priority)
+    await done.wait()
+
+    reordered = sum(1 for indexes in runs.values() if indexes != sorted(indexes))
+    return reordered, overlaps, pool.stats()
+
+
+def p50_ms(samples):
+    return 1000 * sorted(samples)[len(samples) // 2] if samples else 0.0
+
+
+async def main():
+    failures = []
+
+    print("=" * 60)
+    print("PER-FLOW FAIRNESS (200 burst jobs, then 10 quiet jobs)")
+    print("=" * 60)
+    quiet_ranks, waits = await burst_vs_quiet()
+    print(f"  quiet jobs finished at ranks {quiet_ranks[0]}..{quiet_ranks[-1]} of 210")
+    print(f"  queue wait p50: burst {p50_ms(waits['burst']):.1f} ms, quiet {p50_ms(waits['quiet']):.1f} ms")
+    # Served in turn with the burst instead of after it
+    if quiet_ranks[-1] >= 105:
+        failures.append("quiet session waited behind the burst")
+
+    print("=" * 60)
+    print("PER-SESSION ORDERING (2000 jobs, 50 sessions, 5 tenants)")
+    print("=" * 60)
+    reordered, overlaps, stats = await session_order()
+    print(f"  sessions run out of order: {reordered}")
+    print(f"  jobs overlapping within a session: {overlaps}")
+    print(f"  queue wait p50 {stats['queue_wait']['p50_ms']} ms, p99 {stats['queue_wait']['p99_ms']} ms")
+    if reordered or overlaps:
+        failures.append("session jobs reordered or overlapped")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Compare Kafka payload size and encode/decode cost per token chunk for each
+wire format
+"""
+import time
+
+import wire_format
+
+ITERATIONS = 100_000
+
+CHUNK = {
+    "session_id": "3f2b8c1e-6a4d-4e8b-9c1f-2d7e5a9b0c3d",
+    "response": " the",
+    "timestamp": None,
+    "is_chunk": True,
+    "is_done": False,
+    "seq": 1792345678901234,
+    "__faust": {"ns": "faust_app.ChatResponse"}
+}
+
+
+def bench(codec, schema):
+    payload = wire_format.encode(CHUNK, schema, codec)
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        wire_format.encode(CHUNK, schema, codec)
+    encode_us = (time.perf_counter() - start) / ITERATIONS * 1e6
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        wire_format.decode(payload)
+    decode_us = (time.perf_counter() - start) / ITERATIONS * 1e6
+
+    return len(payload), encode_us, decode_us
+
+
+def main():
+    print("=" * 60)
+    print(f"WIRE FORMAT ({ITERATIONS} chunks)")
+    print("=" * 60)
+    print(f"  {'format':<22}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+
+    for codec in ("json", "orjson", "msgpack"):
+        if wire_format.available_codec(codec) != codec:
+            print(f"  {codec:<22}  (not installed)")
+            continue
+        schemas = (None,) if codec == "json" else (None, "chat_response")
+        for schema in schemas:
+            name = codec + (" + schema" if schema else "")
+            size, encode_us, decode_us = bench(codec, schema)
+            print(f"  {name:<22}{size:>8}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class PublishStats:
+    """Counts token chunks in versus records published, across replies"""
+
+    def __init__(self):
+        self.replies = 0
+        self.chunks = 0
+        self.records = 0
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "replies": self.replies,
+            "chunks": self.chunks,
+            "records": self.records,
+            "chunks_per_record": round(self.chunks / self.records, 2) if self.records else 0.0,
+            "records_per_reply": round(self.records / self.replies, 2) if self.replies else 0.0
+        }
+
+
+class ChunkBatcher:
+    """Batches the token chunks of one reply into fewer Kafka records.
+
+    The first chunk is published immediately so time-to-first-token is not
+    affected. Later chunks are accumulated and published as one record once
+    ``max_bytes`` of text is pending or ``max_delay`` seconds after the first
+    pending chunk, whichever comes first. ``close`` publishes whatever is
+    left; callers send the final ``is_done`` record after it, so that record
+    is always last.
+
+    Publishes go through a lock, so records (and the sequence numbers
+    ``send`` stamps on them) stay in chunk order even when a timed flush and
+    a size flush race.
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable], max_bytes: int = 512,
+                 max_delay: float = 0.03, stats: PublishStats = None):
+        self.send = send
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.stats = stats or PublishStats()
+        self._parts = []
+        self._size = 0
+        self._first = True
+        self._timer = None
+        self._timed_flush = None
+        self._lock = asyncio.Lock()
+        self.stats.replies += 1
+
+    async def add(self, chunk: str):
+        if not chunk:
+            return
+        self.stats.chunks += 1
+
+        if self._first:
+            self._first = False
+            await self._publish([chunk])
+            return
+
+        self._parts.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._timed_flush = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._parts:
+            return
+        parts, self._parts, self._size = self._parts, [], 0
+        await self._publish(parts)
+
+    async def close(self):
+        """Publish pending chunks and wait for any timed flush in progress"""
+        await self.flush()
+        if self._timed_flush is not None:
+            try:
+                await self._timed_flush
+            except Exception as e:
+                logger.error(f"Timed chunk flush failed: {e}")
+            self._timed_flush = None
+
+    async def _publish(self, parts):
+        async with self._lock:
+            await self.send("".join(parts))
+            self.stats.records += 1
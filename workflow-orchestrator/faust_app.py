@@ -1,6 +1,16 @@
+import asyncio
 import faust
+import functools
 import logging
-from supervisor_agent import SupervisorAgent
+import os
+import time
+from faust.serializers import codecs
+from supervisor_agent import build_from_env
+from session_pool import SessionTaskPool
+from chunk_batcher import ChunkBatcher, PublishStats
+from request_dedupe import RequestDedupe
+from response_seq import SessionSeq, evict_idle
+import wire_format
 
 logging.basicConfig(
     level=logging.INFO,
@@ -8,15 +18,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Wire format for produced records (json, msgpack or orjson); every format is
+# accepted when consuming. Compression applies to all produced batches.
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "json")
+KAFKA_COMPRESSION_TYPE = os.getenv("KAFKA_COMPRESSION_TYPE") or None
+
+
+class WireCodec(codecs.Codec):
+    """Faust codec for the versioned wire format shared with chat-server"""
+
+    def __init__(self, schema: str = None, wire_codec: str = WIRE_FORMAT, **kwargs):
+        self.schema = schema
+        self.wire_codec = wire_codec
+        super().__init__(schema=schema, wire_codec=wire_codec, **kwargs)
+
+    def _dumps(self, obj) -> bytes:
+        return wire_format.encode(obj, self.schema, self.wire_codec)
+
+    def _loads(self, s: bytes):
+        return wire_format.decode(s)
+
+
 # Initialize Faust app
 app = faust.App(
     'workflow-orchestrator',
     broker='kafka://localhost:9092',
     value_serializer='json',
+    producer_compression_type=KAFKA_COMPRESSION_TYPE,
 )
 
-# Initialize supervisor agent
-supervisor = SupervisorAgent()
+# Initialize supervisor agent (replicas and hedging are configured by the
+# environment, see supervisor_agent.build_from_env)
+supervisor = build_from_env()
 
 
 # Define message models
@@ -24,6 +57,10 @@ class ChatRequest(faust.Record):
     session_id: str
     message: str
     timestamp: float = None
+    reply_topic: str = None
+    request_id: str = None
+    tenant: str = None
+    priority: str = None
 
 
 class ChatResponse(faust.Record):
@@ -32,57 +69,306 @@ class ChatResponse(faust.Record):
     timestamp: float = None
     is_chunk: bool = False
     is_done: bool = False
+    seq: int = None
+    request_id: str = None
+
+
+class ChatControl(faust.Record):
+    """Cancels a request (reason: "superseded" or "disconnected")"""
+    session_id: str
+    request_id: str
+    reason: str = None
+    timestamp: float = None
+
+
+# Define Kafka topics (all messages are keyed by session_id)
+request_codec = WireCodec(schema="chat_request")
+response_codec = WireCodec(schema="chat_response")
+chat_requests_topic = app.topic('chat-requests', key_type=str, value_type=ChatRequest,
+                                value_serializer=request_codec)
+chat_responses_topic = app.topic('chat-responses', key_type=str, value_type=ChatResponse,
+                                 value_serializer=response_codec)
+# Must have as many partitions as chat-requests, so that a session's control
+# messages reach the worker processing its requests
+chat_control_topic = app.topic('chat-control', key_type=str, value_type=ChatControl,
+                               value_serializer=WireCodec(schema="chat_control"))
+
+# Per-instance reply topics requested by chat-server replicas
+reply_topics = {}
+
+
+def get_reply_topic(request: ChatRequest):
+    """Return the topic the chat-server instance hosting this session listens on"""
+    if not request.reply_topic:
+        return chat_responses_topic
+
+    topic = reply_topics.get(request.reply_topic)
+    if topic is None:
+        topic = app.topic(request.reply_topic, key_type=str, value_type=ChatResponse,
+                          value_serializer=response_codec)
+        reply_topics[request.reply_topic] = topic
+    return topic
+
+
+def parse_weights(value: str) -> dict:
+    """Parse "tenant=weight,..." (e.g. "acme=4,free=0.5")"""
+    weights = {}
+    for pair in value.split(","):
+        if "=" in pair:
+            key, weight = pair.split("=", 1)
+            weights[key.strip()] = float(weight)
+    return weights
+
+
+# Requests of different sessions are processed concurrently, each session's in
+# order; waiting sessions are served fairly across tenants (or sessions without
+# a tenant) by weight, interactive requests before batch ones. A tenant or
+# session holds at most AGENT_MAX_PENDING_PER_FLOW of the AGENT_MAX_PENDING
+# admitted requests; its further requests wait in a backlog of AGENT_MAX_HELD
+AGENT_MAX_PENDING = int(os.getenv("AGENT_MAX_PENDING", "1000"))
+pool = SessionTaskPool(
+    concurrency=int(os.getenv("AGENT_CONCURRENCY", "32")),
+    max_pending=AGENT_MAX_PENDING,
+    max_pending_per_flow=int(os.getenv("AGENT_MAX_PENDING_PER_FLOW", str(max(1, AGENT_MAX_PENDING // 10)))),
+    max_held=int(os.getenv("AGENT_MAX_HELD", str(AGENT_MAX_PENDING))),
+    priorities=["interactive", "batch"],
+    weights=parse_weights(os.getenv("TENANT_WEIGHTS", ""))
+)
+
+# Token chunks are batched into fewer records per reply; the first chunk of a
+# reply is always sent immediately
+CHUNK_BATCH_BYTES = int(os.getenv("CHUNK_BATCH_BYTES", "512"))
+CHUNK_BATCH_DELAY_MS = float(os.getenv("CHUNK_BATCH_DELAY_MS", "30"))
+publish_stats = PublishStats()
+
+# Requests already processed, so redelivered requests don't call the LLM again.
+# Keyed by session_id like chat-requests; written from pool tasks, outside the
+# agent's event context, hence use_partitioner.
+DEDUPE_TTL = float(os.getenv("DEDUPE_TTL", "3600"))
+DEDUPE_REPLAY = os.getenv("DEDUPE_REPLAY", "0") == "1"
+processed_requests = app.Table('processed-requests', key_type=str, value_type=dict,
+                               use_partitioner=True)
+dedupe = RequestDedupe(processed_requests, ttl=DEDUPE_TTL, store_responses=DEDUPE_REPLAY)
+
+# Highest sequence number leased per session, so response records keep
+# increasing per session whichever worker handles the session next; sessions
+# idle for RESPONSE_SEQ_TTL seconds are dropped and restart from the clock
+RESPONSE_SEQ_TTL = float(os.getenv("RESPONSE_SEQ_TTL", "3600"))
+response_seqs = app.Table('response-seqs', key_type=str, value_type=int,
+                          use_partitioner=True)
+
+# Streams in progress by request_id, and cancelled request ids (with the time
+# they were cancelled) so queued requests are skipped when their turn comes
+active_streams = {}
+cancelled_requests = {}
+CANCELLED_TTL = 600.0
+
+
+def cancel_request(control: ChatControl) -> bool:
+    """Cancel a request's stream; returns True if it was in progress here"""
+    cancelled_requests[control.request_id] = time.time()
+    task = active_streams.get(control.request_id)
+    if task is None:
+        return False
+    logger.info(f"Cancelling request {control.request_id} for session {control.session_id} ({control.reason})")
+    task.cancel()
+    return True
+
 
+async def handle_chat_request(request: ChatRequest):
+    """Stream the supervisor's response for one request to the reply topic"""
+    reply_topic = get_reply_topic(request)
+    request_id = request.request_id
+    seq = SessionSeq(response_seqs, request.session_id)
 
-# Define Kafka topics
-chat_requests_topic = app.topic('chat-requests', value_type=ChatRequest)
-chat_responses_topic = app.topic('chat-responses', value_type=ChatResponse)
+    async def send_chunk(text: str):
+        chunk_response = ChatResponse(
+            session_id=request.session_id,
+            response=text,
+            is_chunk=True,
+            is_done=False,
+            seq=seq.next(),
+            request_id=request.request_id
+        )
+        await reply_topic.send(key=request.session_id, value=chunk_response)
+
+    async def send_done():
+        done_response = ChatResponse(
+            session_id=request.session_id,
+            response="",
+            is_chunk=False,
+            is_done=True,
+            seq=seq.next(),
+            request_id=request.request_id
+        )
+        await reply_topic.send(key=request.session_id, value=done_response)
+
+    if request_id and cancelled_requests.pop(request_id, None):
+        logger.info(f"Skipping cancelled request {request_id} for session {request.session_id}")
+        dedupe.complete(request.session_id, request_id)
+        await send_done()
+        return
+
+    if request_id:
+        entry = dedupe.lookup(request.session_id, request_id)
+        if entry is not None and entry["status"] == RequestDedupe.DONE:
+            if entry.get("response") is not None:
+                logger.info(f"Replaying stored response for duplicate request {request_id}")
+                dedupe.replayed += 1
+                await send_chunk(entry["response"])
+                await send_done()
+            else:
+                logger.info(f"Skipping duplicate request {request_id} for session {request.session_id}")
+                dedupe.skipped += 1
+            return
+        if entry is not None:
+            logger.warning(f"Request {request_id} was interrupted before completing, processing it again")
+            dedupe.reprocessed += 1
+        dedupe.start(request.session_id, request_id)
+
+    batcher = ChunkBatcher(
+        send_chunk,
+        max_bytes=CHUNK_BATCH_BYTES,
+        max_delay=CHUNK_BATCH_DELAY_MS / 1000,
+        stats=publish_stats
+    )
+    chunks = []
+
+    async def stream_reply():
+        # Use supervisor agent to process the request with streaming
+        async for chunk in supervisor.process_request_stream(
+            request.session_id,
+            request.message
+        ):
+            if dedupe.store_responses:
+                chunks.append(chunk)
+            await batcher.add(chunk)
+
+    # The stream runs in its own task so a control message can cancel it;
+    # cancelling closes the HTTP stream, which stops the LLM call upstream
+    stream_task = asyncio.ensure_future(stream_reply())
+    if request_id:
+        active_streams[request_id] = stream_task
+    try:
+        logger.info(f"Processing streaming request for session {request.session_id}")
+
+        cancelled = False
+        try:
+            await stream_task
+        except asyncio.CancelledError:
+            if not request_id or cancelled_requests.pop(request_id, None) is None:
+                raise
+            logger.info(f"Request {request_id} cancelled after {len(chunks)} chunks")
+            cancelled = True
+            await supervisor.cancel_stream(request.session_id)
+        await batcher.close()
+
+        # Send final "done" message
+        await send_done()
+        if request_id:
+            # A cancelled reply is incomplete, so a duplicate is skipped
+            # rather than replayed
+            dedupe.complete(request.session_id, request_id, None if cancelled else "".join(chunks))
+
+        logger.info(f"Successfully processed streaming request for session {request.session_id}")
+
+    except Exception as e:
+        logger.error(f"Error processing request: {e}")
+        # A failed request may be retried if it is delivered again
+        if request_id:
+            dedupe.forget(request.session_id, request_id)
+        # Publish what was already streamed before the error response
+        await batcher.close()
+        # Send error response
+        error_response = ChatResponse(
+            session_id=request.session_id,
+            response=f"Sorry, I encountered an error: {str(e)}",
+            is_chunk=False,
+            is_done=True,
+            seq=seq.next(),
+            request_id=request.request_id
+        )
+        await reply_topic.send(key=request.session_id, value=error_response)
+
+    finally:
+        if request_id:
+            active_streams.pop(request_id, None)
+        if not stream_task.done():
+            stream_task.cancel()
 
 
 @app.agent(chat_requests_topic)
 async def process_chat_request(requests):
     """
-    Faust agent that processes incoming chat requests with streaming
+    Faust agent that processes incoming chat requests with streaming.
+
+    Requests are handed to the session task pool; each event is acked only
+    once its request has been processed, so offsets are not committed past
+    work that is still in flight.
     """
-    async for request in requests:
-        try:
-            logger.info(f"Processing streaming request for session {request.session_id}")
-
-            # Use supervisor agent to process the request with streaming
-            async for chunk in supervisor.process_request_stream(
-                request.session_id,
-                request.message
-            ):
-                # Send each chunk to Kafka
-                chunk_response = ChatResponse(
-                    session_id=request.session_id,
-                    response=chunk,
-                    is_chunk=True,
-                    is_done=False
-                )
-                await chat_responses_topic.send(value=chunk_response)
-
-            # Send final "done" message
-            done_response = ChatResponse(
-                session_id=request.session_id,
-                response="",
-                is_chunk=False,
-                is_done=True
-            )
-            await chat_responses_topic.send(value=done_response)
-
-            logger.info(f"Successfully processed streaming request for session {request.session_id}")
-
-        except Exception as e:
-            logger.error(f"Error processing request: {e}")
-            # Send error response
-            error_response = ChatResponse(
-                session_id=request.session_id,
-                response=f"Sorry, I encountered an error: {str(e)}",
-                is_chunk=False,
-                is_done=True
-            )
-            await chat_responses_topic.send(value=error_response)
+    async for event in requests.noack().events():
+        request = event.value
+        await pool.submit(
+            request.session_id,
+            functools.partial(handle_chat_request, request),
+            on_done=event.ack,
+            tenant=request.tenant,
+            priority=request.priority
+        )
+
+
+@app.agent(chat_control_topic)
+async def process_chat_control(controls):
+    """Cancels requests superseded by a newer message or abandoned by the user"""
+    async for control in controls:
+        cancel_request(control)
+
+
+@app.page('/metrics/')
+async def metrics(web, request):
+    return web.json({
+        "agent": pool.stats(),
+        "publisher": publish_stats.snapshot(),
+        "conversational_service": supervisor.resilience_stats(),
+        "dedupe": dedupe.stats(),
+        "active_streams": len(active_streams)
+    })
+
+
+@app.on_before_shutdown.connect
+async def close_http_client(app, **kwargs):
+    await supervisor.aclose()
+
+
+@app.timer(interval=supervisor.health_interval)
+async def check_replicas():
+    """Health-check conversational-workflow replicas"""
+    await supervisor.check_replicas()
+
+
+@app.timer(interval=60.0)
+async def evict_processed_requests():
+    """Drop dedupe entries older than DEDUPE_TTL"""
+    expired = dedupe.evict_expired()
+    if expired:
+        logger.info(f"Evicted dedupe entries of {expired} idle sessions")
+
+
+@app.timer(interval=60.0)
+async def evict_response_seqs():
+    """Drop sequence marks of sessions idle for RESPONSE_SEQ_TTL"""
+    expired = evict_idle(response_seqs, RESPONSE_SEQ_TTL)
+    if expired:
+        logger.info(f"Evicted sequence marks of {expired} idle sessions")
+
+
+@app.timer(interval=60.0)
+async def evict_cancelled_requests():
+    """Forget cancellations of requests that never arrived here"""
+    deadline = time.time() - CANCELLED_TTL
+    for request_id, cancelled_at in list(cancelled_requests.items()):
+        if cancelled_at < deadline:
+            del cancelled_requests[request_id]
 
 
 @app.timer(interval=30.0)
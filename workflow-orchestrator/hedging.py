@@ -0,0 +1,72 @@
+import logging
+import threading
+from typing import Dict
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+
+class HedgePolicy:
+    """Decides when a streaming request gets a backup (hedged) request.
+
+    The hedge delay is the ``percentile`` of recent time-to-first-chunk
+    samples (never below ``min_delay``; ``default_delay`` until
+    ``min_samples`` were seen), so only the slowest few percent of requests
+    are hedged. Extra load is capped by a token bucket: every request earns
+    ``budget`` tokens (up to ``burst``) and a hedge spends one, so at most
+    about ``budget`` of requests are hedged over time.
+    """
+
+    def __init__(self, percentile: float = 95.0, min_delay: float = 0.05,
+                 default_delay: float = 1.0, min_samples: int = 20,
+                 budget: float = 0.1, burst: float = 10.0):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.budget = budget
+        self.burst = burst
+        self.first_chunk = LatencyStats()
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self.denied = 0
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        """Count a new request and return how long to wait before hedging it"""
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+            if self.first_chunk.count < self.min_samples:
+                return self.default_delay
+            return max(self.min_delay, self.first_chunk.percentile(self.percentile))
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                self.denied += 1
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def record(self, first_chunk_latency: float, hedge_won: bool):
+        with self._lock:
+            self.first_chunk.record(first_chunk_latency)
+            if hedge_won:
+                self.wins += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "wins": self.wins,
+                "denied": self.denied,
+                "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+                "win_rate": round(self.wins / self.hedges, 4) if self.hedges else 0.0,
+                "first_chunk": self.first_chunk.snapshot()
+            }
@@ -0,0 +1,31 @@
+from collections import deque
+from typing import Dict
+
+
+class LatencyStats:
+    """Running latency statistics over the most recent ``window`` samples"""
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(p / 100 * len(ordered)))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": round(1000 * self.total / self.count, 2) if self.count else 0.0,
+            "p50_ms": round(1000 * self.percentile(50), 2),
+            "p99_ms": round(1000 * self.percentile(99), 2)
+        }
@@ -1,7 +1,10 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
-from supervisor_agent import SupervisorAgent
+import os
+from supervisor_agent import build_from_env
 
 logging.basicConfig(
     level=logging.INFO,
@@ -11,8 +14,16 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Workflow Orchestrator")
 
-# Initialize supervisor agent
-supervisor = SupervisorAgent()
+# Initialize supervisor agent (replicas and hedging are configured by the
+# environment, see supervisor_agent.build_from_env)
+supervisor = build_from_env()
+
+
+# Bounded pool for work that still blocks (e.g. sync graph nodes run by
+# LangGraph in an executor), so it cannot starve the event loop or spawn
+# unbounded threads
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "16"))
+blocking_pool = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="orchestrator-blocking")
 
 
 class ProcessRequest(BaseModel):
@@ -25,11 +36,38 @@ class ProcessResponse(BaseModel):
     response: str
 
 
+async def check_replicas():
+    """Health-check conversational-workflow replicas in the background"""
+    while True:
+        await asyncio.sleep(supervisor.health_interval)
+        try:
+            await supervisor.check_replicas()
+        except Exception as e:
+            logger.error(f"Replica health check failed: {e}")
+
+
+@app.on_event("startup")
+async def startup_event():
+    asyncio.get_running_loop().set_default_executor(blocking_pool)
+    asyncio.create_task(check_replicas())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await supervisor.aclose()
+    blocking_pool.shutdown(wait=False)
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "workflow-orchestrator"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {"conversational_service": supervisor.resilience_stats()}
+
+
 @app.post("/process", response_model=ProcessResponse)
 async def process_message(request: ProcessRequest):
     """Process a chat message through the supervisor agent"""
@@ -37,7 +75,7 @@ async def process_message(request: ProcessRequest):
 
     try:
         # Use supervisor agent to process the request
-        response = supervisor.process_request(request.session_id, request.message)
+        response = await supervisor.aprocess_request(request.session_id, request.message)
 
         logger.info(f"Successfully processed request for session {request.session_id}")
 
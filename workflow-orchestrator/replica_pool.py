@@ -0,0 +1,103 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+from typing import Dict, List
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class ReplicaPool:
+    """Consistent-hash ring of conversational-workflow replicas.
+
+    Chat histories live in the replica that served the session, so each
+    session_id is pinned to a replica: the first healthy one clockwise from
+    the session's point on the ring. Every replica owns ``virtual_nodes``
+    points, which spreads sessions evenly; when a replica goes down only the
+    sessions it owned move to other replicas, and they move back when it
+    recovers.
+
+    Replicas are marked down after ``failure_threshold`` consecutive failed
+    ``/health`` checks and up again after one successful check.
+    """
+
+    def __init__(self, urls: List[str], virtual_nodes: int = 100, failure_threshold: int = 2,
+                 health_timeout: float = 2.0):
+        if not urls:
+            raise ValueError("At least one replica URL is required")
+        self.urls = [url.rstrip("/") for url in urls]
+        self.virtual_nodes = virtual_nodes
+        self.failure_threshold = failure_threshold
+        self.health_timeout = health_timeout
+        self.healthy = {url: True for url in self.urls}
+        self._failures = {url: 0 for url in self.urls}
+
+        points = sorted(
+            (ring_hash(f"{url}#{i}"), url)
+            for url in self.urls
+            for i in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [url for _, url in points]
+
+    def urls_for(self, session_id: str, count: int = 1) -> List[str]:
+        """Up to ``count`` distinct replicas for a session, preferred first.
+
+        Healthy replicas come first in ring order; if fewer than ``count``
+        are healthy the rest are filled with unhealthy ones rather than
+        returning nothing.
+        """
+        start = bisect.bisect(self._hashes, ring_hash(session_id))
+        ordered = []
+        for i in range(len(self._owners)):
+            url = self._owners[(start + i) % len(self._owners)]
+            if url not in ordered:
+                ordered.append(url)
+                if len(ordered) == len(self.urls):
+                    break
+
+        healthy = [url for url in ordered if self.healthy[url]]
+        unhealthy = [url for url in ordered if not self.healthy[url]]
+        return (healthy + unhealthy)[:count]
+
+    def url_for(self, session_id: str) -> str:
+        return self.urls_for(session_id)[0]
+
+    def record_health(self, url: str, ok: bool):
+        if ok:
+            self._failures[url] = 0
+            if not self.healthy[url]:
+                logger.info(f"Replica {url} is healthy again")
+            self.healthy[url] = True
+            return
+
+        self._failures[url] += 1
+        if self.healthy[url] and self._failures[url] >= self.failure_threshold:
+            logger.warning(f"Replica {url} failed {self._failures[url]} health checks, marking it down")
+            self.healthy[url] = False
+
+    async def check_health(self, client: httpx.AsyncClient):
+        """Probe every replica's /health endpoint once"""
+        async def probe(url: str):
+            try:
+                response = await client.get(f"{url}/health", timeout=self.health_timeout)
+                ok = response.status_code == 200
+            except Exception as e:
+                logger.debug(f"Health check of {url} failed: {e}")
+                ok = False
+            self.record_health(url, ok)
+
+        await asyncio.gather(*(probe(url) for url in self.urls))
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "replicas": len(self.urls),
+            "healthy": sum(self.healthy.values()),
+            "status": {url: "up" if healthy else "down" for url, healthy in self.healthy.items()}
+        }
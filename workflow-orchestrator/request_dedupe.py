@@ -0,0 +1,103 @@
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RequestDedupe:
+    """Remembers which chat requests were already processed.
+
+    Kafka delivers at least once, so after a rebalance or crash the agent
+    can see a request again. Entries live in a Faust table keyed by
+    session_id (the key chat-requests is partitioned by) and map request_id
+    to its status. A request marked done is not processed again: it is
+    skipped, or with ``store_responses`` its stored response is replayed
+    without calling the LLM. A request left in progress by a crashed
+    worker is processed again, since no result was recorded for it.
+
+    Entries expire ``ttl`` seconds after their last update. A session's
+    entries are written to the changelog as a whole on every update, so each
+    session keeps only its latest ``max_entries`` entries, and only the
+    latest ``max_responses`` keep their response. A session's requests are
+    acked in order, so redeliveries only ever concern its latest requests.
+    """
+
+    IN_PROGRESS = "in_progress"
+    DONE = "done"
+
+    def __init__(self, table, ttl: float = 3600.0, store_responses: bool = False,
+                 max_entries: int = 64, max_responses: int = 4):
+        self.table = table
+        self.ttl = ttl
+        self.store_responses = store_responses
+        self.max_entries = max_entries
+        self.max_responses = max_responses
+        self.skipped = 0
+        self.replayed = 0
+        self.reprocessed = 0
+        self.expired = 0
+
+    def lookup(self, session_id: str, request_id: str) -> Optional[dict]:
+        entry = (self.table.get(session_id) or {}).get(request_id)
+        if entry is None or time.time() - entry["updated_at"] >= self.ttl:
+            return None
+        return entry
+
+    def start(self, session_id: str, request_id: str):
+        self._update(session_id, request_id, {"status": self.IN_PROGRESS, "updated_at": time.time()})
+
+    def complete(self, session_id: str, request_id: str, response: str = None):
+        """Mark a request done; without a response (e.g. it was cancelled
+        before running) a duplicate is skipped rather than replayed"""
+        entry = {"status": self.DONE, "updated_at": time.time()}
+        if self.store_responses and response is not None:
+            entry["response"] = response
+        self._update(session_id, request_id, entry)
+
+    def forget(self, session_id: str, request_id: str):
+        self._update(session_id, request_id, None)
+
+    def _update(self, session_id: str, request_id: str, entry: Optional[dict]):
+        # Table values are only written back on assignment, so the session's
+        # entries are rebuilt (dropping expired ones) and stored as a whole,
+        # oldest first
+        now = time.time()
+        entries = {
+            rid: value for rid, value in (self.table.get(session_id) or {}).items()
+            if now - value["updated_at"] < self.ttl
+        }
+        entries.pop(request_id, None)
+        if entry is not None:
+            entries[request_id] = entry
+
+        for rid in list(entries)[:-self.max_entries]:
+            del entries[rid]
+        for rid in list(entries)[:-self.max_responses]:
+            if "response" in entries[rid]:
+                entries[rid] = {key: value for key, value in entries[rid].items() if key != "response"}
+
+        if entries:
+            self.table[session_id] = entries
+        elif session_id in self.table:
+            del self.table[session_id]
+
+    def evict_expired(self) -> int:
+        """Drop sessions whose entries all expired; returns the number dropped"""
+        now = time.time()
+        expired = [
+            session_id for session_id, entries in list(self.table.items())
+            if all(now - value["updated_at"] >= self.ttl for value in entries.values())
+        ]
+        for session_id in expired:
+            del self.table[session_id]
+        self.expired += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "skipped": self.skipped,
+            "replayed": self.replayed,
+            "reprocessed": self.reprocessed,
+            "expired_sessions": self.expired
+        }
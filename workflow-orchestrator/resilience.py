@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "I'm handling a lot of conversations right now. Please try again in a moment."
+UNAVAILABLE_MESSAGE = "I'm temporarily unable to answer. Please try again in a few seconds."
+
+
+def is_failure_status(status_code: int) -> bool:
+    """Responses that signal an overloaded or failing upstream"""
+    return status_code >= 500 or status_code == 429
+
+
+class ServiceUnavailable(Exception):
+    """A call was refused up front; the message is safe to show to users"""
+
+
+class AdaptiveLimiter:
+    """Concurrency limit adjusted with AIMD from observed latency.
+
+    Calls beyond the current limit are rejected immediately instead of
+    queueing behind a slow upstream. The limit grows by about one per
+    ``limit`` successful calls while it is being used, and is multiplied by
+    ``backoff`` when a call fails or its latency exceeds ``tolerance`` times
+    the long-run average (at most once per ``cooldown`` seconds, so a burst
+    of slow responses counts as one congestion signal).
+
+    Thread-safe, so the sync graph nodes running in the executor and the
+    async streaming path share one limit.
+    """
+
+    def __init__(self, initial_limit: int = 20, min_limit: int = 1, max_limit: int = 200,
+                 backoff: float = 0.9, tolerance: float = 2.0, smoothing: float = 0.05,
+                 cooldown: float = 1.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+        self.baseline = None
+        self.in_flight = 0
+        self.rejections = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.rejections += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float = None, failed: bool = False):
+        """Release a slot; ``latency`` is None when no sample was taken"""
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+
+            if failed or (latency is not None and self.baseline is not None
+                          and latency > self.tolerance * self.baseline):
+                self._decrease()
+            elif latency is not None and in_flight * 2 >= self.limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            if latency is not None and not failed:
+                if self.baseline is None:
+                    self.baseline = latency
+                else:
+                    self.baseline += self.smoothing * (latency - self.baseline)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.decreases += 1
+        logger.warning(f"Conversational service congested, concurrency limit now {int(self.limit)}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "rejections": self.rejections,
+                "decreases": self.decreases,
+                "baseline_ms": round(1000 * self.baseline, 2) if self.baseline is not None else None
+            }
+
+
+class CircuitBreaker:
+    """Fails calls fast while the upstream keeps failing.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    rejects calls for ``reset_timeout`` seconds. It then lets a single trial
+    call through (half-open): success closes it, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.rejections = 0
+        self._opened_at = 0.0
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_started = now
+                return True
+            # A trial whose outcome was never recorded (e.g. cancelled) must
+            # not keep the breaker half-open forever
+            if self.state == self.HALF_OPEN and now - self._trial_started >= self.reset_timeout:
+                self._trial_started = now
+                return True
+
+            self.rejections += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Conversational service recovered, circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.opens += 1
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opens": self.opens,
+                "rejections": self.rejections
+            }
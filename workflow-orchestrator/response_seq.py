@@ -0,0 +1,56 @@
+import time
+
+
+def clock_seq() -> int:
+    return time.time_ns() // 1000
+
+
+class SessionSeq:
+    """Sequence numbers for the response records of one request.
+
+    Numbers must keep increasing per session across rebalances, when the
+    next request of a session may be handled by a worker whose clock is
+    behind. The high-water mark of each session lives in a Faust table keyed
+    by session_id: a request leases a block of ``block`` numbers from it
+    (one table write per block rather than per record), and the worker that
+    handles the session next starts after the end of that block.
+
+    A lease never starts below the current time in microseconds, so a
+    session's high-water mark stays within a block (plus clock skew between
+    workers) of the time of its last lease. That is what lets idle entries
+    be evicted (see ``evict_idle``): a session without an entry starts from
+    the clock, which has long passed the evicted mark.
+
+    A session's requests are processed one at a time, so a lease is never
+    shared between concurrent requests.
+    """
+
+    def __init__(self, table, session_id: str, block: int = 1000):
+        self.table = table
+        self.session_id = session_id
+        self.block = block
+        self._next = None
+        self._limit = None
+
+    def next(self) -> int:
+        if self._next is None or self._next >= self._limit:
+            self._lease()
+        seq = self._next
+        self._next += 1
+        return seq
+
+    def _lease(self):
+        start = max(self.table.get(self.session_id) or 0, clock_seq())
+        self._next = start
+        self._limit = start + self.block
+        self.table[self.session_id] = self._limit
+
+
+def evict_idle(table, ttl: float) -> int:
+    """Drop the marks of sessions without a lease for ``ttl`` seconds;
+    returns the number dropped"""
+    deadline = clock_seq() - int(ttl * 1_000_000)
+    idle = [session_id for session_id, limit in list(table.items()) if limit < deadline]
+    for session_id in idle:
+        del table[session_id]
+    return len(idle)
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Hashable, List
+
+from fair_scheduler import FairScheduler
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+
+class SessionTaskPool:
+    """Runs jobs concurrently across sessions, strictly in order within a session.
+
+    Each session has a FIFO of jobs, and a session is handed to at most one
+    worker at a time, so a session's requests never overlap or reorder while
+    up to ``concurrency`` different sessions are processed in parallel.
+
+    Admission is bounded and fair per flow (a tenant, or a session without
+    one). At most ``max_pending`` jobs are admitted (queued or running), and
+    a flow may hold at most ``max_pending_per_flow`` of them. Jobs beyond
+    that are held back in a per-flow backlog of up to ``max_held`` jobs in
+    total; as slots free up they go to the held flows with the fewest
+    admitted jobs. ``submit`` only waits when the backlog is full, which
+    pushes back on the Kafka consumer instead of buffering without bound,
+    and a session sending a burst of messages neither fills the pool nor
+    stops the consumer from reaching other sessions' requests.
+
+    Sessions waiting for a worker are picked by a FairScheduler: deficit
+    round robin across tenants (or sessions without a tenant) with
+    per-tenant ``weights``, within strict ``priorities`` classes, so one
+    busy tenant or session cannot starve the others.
+
+    Queue wait (submit to start) and processing time are tracked separately,
+    and queue depth and wait per priority class.
+    """
+
+    def __init__(self, concurrency: int = 32, max_pending: int = 1000,
+                 priorities: List[str] = ("interactive", "batch"),
+                 weights: Dict[Hashable, float] = None, max_pending_per_flow: int = None,
+                 max_held: int = None):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.max_pending_per_flow = max_pending_per_flow or max(1, max_pending // 10)
+        self.max_held = max_held or max_pending
+        self.priorities = list(priorities)
+        self.weights = weights or {}
+        self.queue_wait = LatencyStats()
+        self.processing = LatencyStats()
+        self.class_wait = {priority: LatencyStats() for priority in self.priorities}
+        self._class_queued = {priority: 0 for priority in self.priorities}
+        self._jobs: Dict[str, deque] = {}
+        self._ready = None
+        # Admitted jobs in total and per flow
+        self._pending = 0
+        self._flow_pending: Dict[Hashable, int] = {}
+        # Held jobs as (session_id, job entry) per flow, flows in turn order;
+        # submitters waiting for backlog space are counted per flow so that
+        # a flow's jobs are never admitted out of order
+        self._held: "OrderedDict[Hashable, deque]" = OrderedDict()
+        self._held_count = 0
+        self._held_space = None
+        self._waiting: Dict[Hashable, int] = {}
+        self._workers = []
+        self._running = 0
+
+    def _start(self):
+        self._ready = FairScheduler(self.priorities, self.weights)
+        self._held_space = asyncio.Semaphore(self.max_held)
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+
+    def _schedule(self, session_id: str):
+        """Queue an idle session for a worker, under its next job's tenant and class"""
+        _, _, _, tenant, priority = self._jobs[session_id][0]
+        self._ready.put(session_id, tenant or session_id, priority)
+
+    async def submit(self, session_id: str, job: Callable[[], Awaitable],
+                     on_done: Callable[[], None] = None, tenant: str = None,
+                     priority: str = None):
+        """Queue ``job`` behind the session's earlier jobs; ``on_done`` runs when it finished.
+
+        ``priority`` is one of the pool's priority classes (default: the
+        first one) and ``tenant`` groups sessions that share a fair share.
+        """
+        if self._ready is None:
+            self._start()
+        if priority not in self._class_queued:
+            priority = self.priorities[0]
+
+        flow = tenant or session_id
+        entry = (job, on_done, time.monotonic(), tenant, priority)
+        if self._can_admit_now(flow):
+            self._class_queued[priority] += 1
+            self._admit(flow, session_id, entry)
+            return
+
+        self._waiting[flow] = self._waiting.get(flow, 0) + 1
+        try:
+            await self._held_space.acquire()
+        finally:
+            self._waiting[flow] -= 1
+            if not self._waiting[flow]:
+                del self._waiting[flow]
+
+        self._class_queued[priority] += 1
+        if self._can_admit_now(flow):
+            self._held_space.release()
+            self._admit(flow, session_id, entry)
+            return
+        self._held.setdefault(flow, deque()).append((session_id, entry))
+        self._held_count += 1
+
+    def _can_admit(self, flow: Hashable) -> bool:
+        return (self._pending < self.max_pending
+                and self._flow_pending.get(flow, 0) < self.max_pending_per_flow)
+
+    def _can_admit_now(self, flow: Hashable) -> bool:
+        # Earlier jobs of the flow that are held or waiting go first
+        return flow not in self._held and flow not in self._waiting and self._can_admit(flow)
+
+    def _admit(self, flow: Hashable, session_id: str, entry: tuple):
+        self._pending += 1
+        self._flow_pending[flow] = self._flow_pending.get(flow, 0) + 1
+        jobs = self._jobs.get(session_id)
+        idle = jobs is None
+        if idle:
+            jobs = self._jobs[session_id] = deque()
+        jobs.append(entry)
+        if idle:
+            self._schedule(session_id)
+
+    def _release(self, flow: Hashable):
+        self._pending -= 1
+        self._flow_pending[flow] -= 1
+        if not self._flow_pending[flow]:
+            del self._flow_pending[flow]
+
+        # Hand free slots to the held flows with the fewest admitted jobs,
+        # earliest in turn among equals
+        while self._held and self._pending < self.max_pending:
+            candidates = [
+                (self._flow_pending.get(held_flow, 0), index, held_flow)
+                for index, held_flow in enumerate(self._held)
+                if self._flow_pending.get(held_flow, 0) < self.max_pending_per_flow
+            ]
+            if not candidates:
+                return
+            _, _, held_flow = min(candidates)
+            held = self._held[held_flow]
+            session_id, entry = held.popleft()
+            if held:
+                self._held.move_to_end(held_flow)
+            else:
+                del self._held[held_flow]
+            self._held_count -= 1
+            self._held_space.release()
+            self._admit(held_flow, session_id, entry)
+
+    async def _worker(self):
+        while True:
+            session_id = await self._ready.get()
+            jobs = self._jobs[session_id]
+            job, on_done, enqueued_at, tenant, priority = jobs.popleft()
+
+            started_at = time.monotonic()
+            self.queue_wait.record(started_at - enqueued_at)
+            self.class_wait[priority].record(started_at - enqueued_at)
+            self._class_queued[priority] -= 1
+            self._running += 1
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"Job for session {session_id} failed: {e}")
+            finally:
+                self._running -= 1
+                self.processing.record(time.monotonic() - started_at)
+                if on_done is not None:
+                    on_done()
+
+            if jobs:
+                self._schedule(session_id)
+            else:
+                del self._jobs[session_id]
+            # Released after the session is rescheduled or removed, so a
+            # held job admitted here finds the session's queue in step
+            self._release(tenant or session_id)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "queued": sum(len(jobs) for jobs in self._jobs.values()),
+            "held": self._held_count,
+            "sessions": len(self._jobs),
+            "queue_wait": self.queue_wait.snapshot(),
+            "processing": self.processing.snapshot(),
+            "classes": {
+                priority: {
+                    "queued": self._class_queued[priority],
+                    "wait": self.class_wait[priority].snapshot()
+                }
+                for priority in self.priorities
+            }
+        }
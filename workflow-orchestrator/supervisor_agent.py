@@ -1,13 +1,36 @@
+import asyncio
 import logging
-from typing import TypedDict, Annotated, AsyncGenerator
+import os
+from typing import TypedDict, Annotated, AsyncGenerator, List, Optional
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
+import httpx
 import requests
 import json
+import time
+from hedging import HedgePolicy
+from replica_pool import ReplicaPool
+from resilience import (
+    AdaptiveLimiter, CircuitBreaker, ServiceUnavailable, BUSY_MESSAGE, UNAVAILABLE_MESSAGE,
+    is_failure_status
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Marks the end of a replica stream passed through a queue
+_END = object()
+
+
+class UpstreamError(Exception):
+    """The conversational workflow answered with a non-200 status"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
 class AgentState(TypedDict):
     session_id: str
     user_message: str
@@ -15,19 +38,108 @@ class AgentState(TypedDict):
     error: str
 
 
+def build_from_env() -> "SupervisorAgent":
+    """Create the SupervisorAgent configured by the environment.
+
+    - ``CONVERSATIONAL_SERVICE_URLS``: conversational-workflow replicas
+      (comma separated); sessions are spread across them by consistent hashing
+    - ``REPLICA_HEALTH_INTERVAL``: seconds between replica health checks
+    - ``HEDGE_REQUESTS=1``: streams without a first chunk after the
+      ``HEDGE_PERCENTILE`` first-chunk latency get a backup request, for at
+      most ``HEDGE_BUDGET`` of requests. Only takes effect with two or
+      more replicas.
+    """
+    urls = [
+        url.strip() for url in os.getenv("CONVERSATIONAL_SERVICE_URLS", "http://localhost:8001").split(",")
+        if url.strip()
+    ]
+    hedge = None
+    if os.getenv("HEDGE_REQUESTS", "0") == "1":
+        hedge = HedgePolicy(
+            percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+            budget=float(os.getenv("HEDGE_BUDGET", "0.1"))
+        )
+    return SupervisorAgent(
+        conversational_service_urls=urls,
+        hedge=hedge,
+        health_interval=float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))
+    )
+
+
 class SupervisorAgent:
-    def __init__(self, conversational_service_url='http://localhost:8001'):
-        self.conversational_service_url = conversational_service_url
+    def __init__(self, conversational_service_url='http://localhost:8001',
+                 max_connections=200, max_keepalive_connections=50,
+                 connect_timeout=5.0, read_timeout=60.0, http2=True,
+                 limiter: AdaptiveLimiter = None, breaker: CircuitBreaker = None,
+                 conversational_service_urls: List[str] = None, hedge: HedgePolicy = None,
+                 health_interval: float = 5.0):
+        # Sessions are pinned to a replica by consistent hashing, since each
+        # replica keeps the chat histories of the sessions it served
+        self.replicas = ReplicaPool(conversational_service_urls or [conversational_service_url])
+        self.conversational_service_url = self.replicas.urls[0]
+        # Seconds between check_replicas() calls, run by the host service
+        self.health_interval = health_interval
+        # Opt-in: with a HedgePolicy, slow streams get a backup request to
+        # another replica (see _hedged_stream)
+        self.hedge = hedge
+        # Shared by /chat and /chat/stream calls: excess load is rejected up
+        # front instead of piling up until every request times out
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
         self.graph = self._build_graph()
 
+        # Shared keep-alive pool for streaming calls, created on first use so it
+        # binds to the event loop that runs the requests
+        self.http_limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.http_timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.http2 = http2
+        self._http_client = None
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.http_limits,
+                timeout=self.http_timeout
+            )
+        return self._http_client
+
+    async def check_replicas(self):
+        """Run one round of replica health checks; call periodically"""
+        await self.replicas.check_health(self.http_client)
+
+    async def cancel_stream(self, session_id: str):
+        """Ask the session's replicas to stop generating its answer.
+
+        Closing the stream's connection already stops the upstream LLM call;
+        this also covers connections a proxy keeps open.
+        """
+        for url in self.replicas.urls_for(session_id, 2 if self.hedge else 1):
+            try:
+                await self.http_client.post(f"{url}/sessions/{session_id}/cancel", timeout=2.0)
+            except Exception as e:
+                logger.warning(f"Failed to cancel stream for session {session_id} at {url}: {e}")
+
+    async def aclose(self):
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
     def _build_graph(self):
         workflow = StateGraph(AgentState)
 
-        # Add nodes
-        workflow.add_node("receive_request", self.receive_request)
-        workflow.add_node("call_conversational_workflow", self.call_conversational_workflow)
-        workflow.add_node("handle_response", self.handle_response)
-        workflow.add_node("handle_error", self.handle_error)
+        # Add nodes; each has a sync and an async implementation so the graph
+        # runs under both invoke() and ainvoke()
+        workflow.add_node("receive_request", self._node(self.receive_request))
+        workflow.add_node("call_conversational_workflow", self._node(
+            self.call_conversational_workflow, self.acall_conversational_workflow
+        ))
+        workflow.add_node("handle_response", self._node(self.handle_response))
+        workflow.add_node("handle_error", self._node(self.handle_error))
 
         # Add edges
         workflow.set_entry_point("receive_request")
@@ -48,6 +160,15 @@ class SupervisorAgent:
 
         return workflow.compile()
 
+    @staticmethod
+    def _node(func, afunc=None) -> RunnableLambda:
+        """Wrap a node; without ``afunc`` the (cheap, non-blocking) sync
+        function runs inline under ainvoke() instead of in a thread"""
+        if afunc is None:
+            async def afunc(state: AgentState) -> AgentState:
+                return func(state)
+        return RunnableLambda(func, afunc=afunc)
+
     def receive_request(self, state: AgentState) -> AgentState:
         logger.info(f"Supervisor received request for session {state['session_id']}")
         return state
@@ -55,37 +176,123 @@ class SupervisorAgent:
     def call_conversational_workflow(self, state: AgentState) -> AgentState:
         logger.info(f"Calling conversational workflow for session {state['session_id']}")
 
+        try:
+            self._admit()
+        except ServiceUnavailable as e:
+            return self._reject(state, e)
+
+        started = time.monotonic()
+        failed = None
         try:
             response = requests.post(
-                f"{self.conversational_service_url}/chat",
+                f"{self.replicas.url_for(state['session_id'])}/chat",
                 json={
                     "session_id": state["session_id"],
                     "message": state["user_message"]
                 },
                 timeout=30
             )
+            failed = is_failure_status(response.status_code)
+            self._apply_response(state, response)
+
+        except Exception as e:
+            failed = True
+            state["error"] = str(e) or type(e).__name__
+            logger.error(f"Failed to call conversational workflow: {e}")
+
+        finally:
+            self._complete(time.monotonic() - started, failed)
 
-            if response.status_code == 200:
-                data = response.json()
-                state["response"] = data.get("response", "")
-                logger.info(f"Received response from conversational workflow")
-            else:
-                state["error"] = f"HTTP {response.status_code}: {response.text}"
-                logger.error(f"Error from conversational workflow: {state['error']}")
+        return state
+
+    async def acall_conversational_workflow(self, state: AgentState) -> AgentState:
+        logger.info(f"Calling conversational workflow for session {state['session_id']}")
+
+        try:
+            self._admit()
+        except ServiceUnavailable as e:
+            return self._reject(state, e)
+
+        started = time.monotonic()
+        failed = None
+        try:
+            response = await self.http_client.post(
+                f"{self.replicas.url_for(state['session_id'])}/chat",
+                json={
+                    "session_id": state["session_id"],
+                    "message": state["user_message"]
+                },
+                timeout=30
+            )
+            failed = is_failure_status(response.status_code)
+            self._apply_response(state, response)
 
         except Exception as e:
-            state["error"] = str(e)
+            # httpx timeouts can have an empty message; keep the error non-empty
+            # so the graph still routes to handle_error
+            failed = True
+            state["error"] = str(e) or type(e).__name__
             logger.error(f"Failed to call conversational workflow: {e}")
 
+        finally:
+            self._complete(time.monotonic() - started, failed)
+
         return state
 
+    @staticmethod
+    def _apply_response(state: AgentState, response):
+        """Copy a /chat response (requests or httpx) into the graph state"""
+        if response.status_code == 200:
+            data = response.json()
+            state["response"] = data.get("response", "")
+            logger.info(f"Received response from conversational workflow")
+        else:
+            state["error"] = f"HTTP {response.status_code}: {response.text}"
+            logger.error(f"Error from conversational workflow: {state['error']}")
+
+    def _admit(self):
+        """Take a concurrency slot, or raise ServiceUnavailable to fail fast"""
+        if not self.limiter.try_acquire():
+            raise ServiceUnavailable(BUSY_MESSAGE)
+        if not self.breaker.allow():
+            self.limiter.release()
+            raise ServiceUnavailable(UNAVAILABLE_MESSAGE)
+
+    def _complete(self, latency: float, failed: bool = None):
+        """Release the slot taken by _admit; ``failed`` is None when the call
+        never finished (e.g. it was cancelled), which is not held against
+        the upstream"""
+        if failed is None:
+            self.limiter.release()
+            return
+        self.limiter.release(latency, failed)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    @staticmethod
+    def _reject(state: AgentState, error: ServiceUnavailable) -> AgentState:
+        logger.warning(f"Rejected request for session {state['session_id']}: {error}")
+        state["error"] = state["response"] = str(error)
+        return state
+
+    def resilience_stats(self) -> dict:
+        return {
+            "limiter": self.limiter.stats(),
+            "circuit_breaker": self.breaker.stats(),
+            "replicas": self.replicas.stats(),
+            "hedging": self.hedge.stats() if self.hedge else None
+        }
+
     def handle_response(self, state: AgentState) -> AgentState:
         logger.info(f"Processing successful response for session {state['session_id']}")
         return state
 
     def handle_error(self, state: AgentState) -> AgentState:
         logger.error(f"Processing error for session {state['session_id']}: {state['error']}")
-        state["response"] = f"Sorry, I encountered an error: {state['error']}"
+        # Fail-fast rejections already carry a message meant for the user
+        state["response"] = state["response"] or f"Sorry, I encountered an error: {state['error']}"
         return state
 
     def process_request(self, session_id: str, user_message: str) -> str:
@@ -101,40 +308,207 @@ class SupervisorAgent:
 
         return final_state["response"]
 
+    async def aprocess_request(self, session_id: str, user_message: str) -> str:
+        """Async version of process_request; runs the graph on the event loop
+        using the shared HTTP client"""
+        initial_state = AgentState(
+            session_id=session_id,
+            user_message=user_message,
+            response="",
+            error=""
+        )
+
+        logger.info(f"Starting supervisor graph for session {session_id}")
+        final_state = await self.graph.ainvoke(initial_state)
+
+        return final_state["response"]
+
     async def process_request_stream(self, session_id: str, user_message: str) -> AsyncGenerator[str, None]:
         """Process request with streaming response"""
         logger.info(f"Starting supervisor streaming for session {session_id}")
 
         try:
-            response = requests.post(
-                f"{self.conversational_service_url}/chat/stream",
-                json={
-                    "session_id": session_id,
-                    "message": user_message
-                },
-                stream=True,
-                timeout=60
-            )
+            self._admit()
+        except ServiceUnavailable as e:
+            logger.warning(f"Rejected request for session {session_id}: {e}")
+            yield str(e)
+            return
+
+        # The limiter's latency sample is the time to the first chunk, since
+        # the length of the whole stream depends on the answer
+        started = time.monotonic()
+        latency = None
+        failed = None
+        urls = self.replicas.urls_for(session_id, 2 if self.hedge else 1)
+        # Only hedge to a second replica that is up. Replicas do not record
+        # the turn of a hedged request; the answer that was kept (as far as
+        # it got) is recorded on the session's replica once the stream ends
+        hedged = len(urls) > 1 and self.replicas.healthy[urls[1]]
+        if hedged:
+            stream = self._hedged_stream(session_id, user_message, urls[0], urls[1])
+        else:
+            stream = self._stream_from(urls[0], session_id, user_message)
+        streamed = []
+        try:
+            async for chunk in stream:
+                if latency is None:
+                    latency = time.monotonic() - started
+                if hedged:
+                    streamed.append(chunk)
+                yield chunk
+            failed = False
 
-            if response.status_code == 200:
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line.decode('utf-8'))
-                            if "chunk" in data:
-                                yield data["chunk"]
-                            elif "error" in data:
-                                logger.error(f"Error from conversational workflow: {data['error']}")
-                                yield f"Error: {data['error']}"
-                                break
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Failed to decode JSON: {e}")
-                            continue
-            else:
-                error_msg = f"HTTP {response.status_code}: {response.text}"
-                logger.error(f"Error from conversational workflow: {error_msg}")
-                yield f"Sorry, I encountered an error: {error_msg}"
+        except UpstreamError as e:
+            failed = is_failure_status(e.status_code)
+            logger.error(f"Error from conversational workflow: {e}")
+            yield f"Sorry, I encountered an error: {e}"
 
         except Exception as e:
+            failed = True
             logger.error(f"Failed to call conversational workflow: {e}")
             yield f"Sorry, I encountered an error: {str(e)}"
+
+        finally:
+            await stream.aclose()
+            if latency is None:
+                latency = time.monotonic() - started
+            self._complete(latency, failed)
+            if streamed:
+                await self._record_turn(urls[0], session_id, user_message, "".join(streamed))
+
+    async def _record_turn(self, url: str, session_id: str, user_message: str, response: str):
+        """Record the turn of a hedged request on the session's replica"""
+        try:
+            result = await self.http_client.post(
+                f"{url}/sessions/{session_id}/turns",
+                json={"message": user_message, "response": response},
+                timeout=5.0
+            )
+            result.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Failed to record turn for session {session_id} at {url}: {e}")
+
+    async def _fetch_history(self, url: str, session_id: str) -> Optional[List[dict]]:
+        """The session's chat history from its replica, or None if it cannot be read"""
+        try:
+            result = await self.http_client.get(f"{url}/sessions/{session_id}/history", timeout=2.0)
+            result.raise_for_status()
+            return result.json()["history"]
+        except Exception as e:
+            logger.warning(f"Failed to fetch history for session {session_id} from {url}: {e}")
+            return None
+
+    async def _stream_from(self, url: str, session_id: str, user_message: str,
+                           record_turn: bool = True, history: List[dict] = None) -> AsyncGenerator[str, None]:
+        """Stream chunks from one replica; raises UpstreamError on non-200 responses.
+
+        With ``record_turn`` False the replica leaves the turn out of the
+        session's history, and ``history`` is sent for it to answer with.
+        """
+        body = {
+            "session_id": session_id,
+            "message": user_message
+        }
+        if not record_turn:
+            body["record_turn"] = False
+        if history is not None:
+            body["history"] = history
+        async with self.http_client.stream(
+            "POST",
+            f"{url}/chat/stream",
+            json=body
+        ) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise UpstreamError(
+                    response.status_code,
+                    f"HTTP {response.status_code}: {body.decode('utf-8', errors='replace')}"
+                )
+
+            async for line in response.aiter_lines():
+                if line:
+                    try:
+                        data = json.loads(line)
+                        if "chunk" in data:
+                            yield data["chunk"]
+                        elif "error" in data:
+                            logger.error(f"Error from conversational workflow: {data['error']}")
+                            yield f"Error: {data['error']}"
+                            break
+                    except json.JSONDecodeError as e:
+                        logger.error(f"Failed to decode JSON: {e}")
+                        continue
+
+    async def _pump(self, url: str, session_id: str, user_message: str, queue: asyncio.Queue,
+                    history: List[dict] = None):
+        """Run one replica stream of a hedged request in its own task, passing
+        its chunks, then _END or the exception that ended it, through ``queue``"""
+        try:
+            async for chunk in self._stream_from(url, session_id, user_message,
+                                                 record_turn=False, history=history):
+                await queue.put(chunk)
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(e)
+
+    async def _hedged_stream(self, session_id: str, user_message: str, primary_url: str,
+                             backup_url: str) -> AsyncGenerator[str, None]:
+        """Stream from the session's replica, hedging to the next replica on
+        the ring when the first chunk takes longer than the hedge delay.
+
+        Whichever request yields its first chunk first is kept and the other
+        one is cancelled, which closes its connection. The backup replica
+        does not hold the session's history, so it is fetched from the
+        session's replica and sent along; no hedge is sent if that fails.
+        Neither replica records the turn (process_request_stream does).
+        """
+        started = time.monotonic()
+        delay = self.hedge.delay()
+
+        queues = [asyncio.Queue(maxsize=64)]
+        pumps = [asyncio.ensure_future(self._pump(primary_url, session_id, user_message, queues[0]))]
+        getters = {asyncio.ensure_future(queues[0].get()): 0}
+        winner = None
+        first = None
+        try:
+            done, _ = await asyncio.wait(getters, timeout=delay)
+            if not done and self.hedge.try_hedge():
+                history = await self._fetch_history(primary_url, session_id)
+                # The first chunk may have arrived while fetching the history
+                if history is not None and not any(getter.done() for getter in getters):
+                    logger.info(f"No first chunk after {1000 * delay:.0f} ms for session {session_id}, "
+                                f"hedging to {backup_url}")
+                    queues.append(asyncio.Queue(maxsize=64))
+                    pumps.append(asyncio.ensure_future(
+                        self._pump(backup_url, session_id, user_message, queues[1], history)
+                    ))
+                    getters[asyncio.ensure_future(queues[1].get())] = 1
+
+            # Keep the first stream that produces a chunk; a stream that
+            # failed only wins when no other stream is left
+            while winner is None:
+                done, _ = await asyncio.wait(getters, return_when=asyncio.FIRST_COMPLETED)
+                for getter in done:
+                    index = getters.pop(getter)
+                    item = getter.result()
+                    if not isinstance(item, Exception) or not getters:
+                        winner, first = index, item
+                        break
+
+            self.hedge.record(time.monotonic() - started, hedge_won=winner == 1)
+        finally:
+            for getter in getters:
+                getter.cancel()
+            for index, pump in enumerate(pumps):
+                if index != winner:
+                    pump.cancel()
+
+        try:
+            item = first
+            while item is not _END:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+                item = await queues[winner].get()
+        finally:
+            pumps[winner].cancel()
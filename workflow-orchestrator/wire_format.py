@@ -0,0 +1,97 @@
+"""
+Versioned wire format for Kafka payloads shared by chat-server and
+workflow-orchestrator (keep both copies identical; `python
+check_shared_modules.py` compares them).
+
+Encoded payloads start with a 4 byte header:
+
+    MAGIC (0xC7) | VERSION | CODEC | SCHEMA
+
+CODEC is the body encoding (msgpack or orjson/JSON). SCHEMA names a
+record layout: tagged records are sent as a positional list of field
+values instead of a map, so field names are not repeated in every token
+chunk. Schemas only ever get new fields appended; a decoder leaves out
+fields missing from older payloads and ignores extra ones.
+
+Plain JSON payloads (no header) are always accepted, and the ``json``
+codec produces them, which keeps messages readable when debugging and
+lets producers and consumers be upgraded independently.
+"""
+import json
+from typing import Any, Dict, Optional
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAGIC = 0xC7
+VERSION = 1
+
+CODEC_IDS = {"msgpack": 1, "orjson": 2}
+CODEC_NAMES = {code: name for name, code in CODEC_IDS.items()}
+
+# Field layouts by schema id; append new fields, never reorder or remove
+SCHEMAS = {
+    1: ("chat_request", ("session_id", "message", "timestamp", "reply_topic", "request_id", "tenant", "priority")),
+    2: ("chat_response", ("session_id", "response", "timestamp", "is_chunk", "is_done", "seq", "request_id")),
+    3: ("chat_control", ("session_id", "request_id", "reason", "timestamp")),
+}
+SCHEMA_IDS = {name: schema_id for schema_id, (name, _) in SCHEMAS.items()}
+
+
+def available_codec(codec: str) -> str:
+    """Return ``codec`` if its library is installed, else fall back to ``json``"""
+    if codec == "msgpack" and msgpack is None:
+        return "json"
+    if codec == "orjson" and orjson is None:
+        return "json"
+    if codec not in CODEC_IDS:
+        return "json"
+    return codec
+
+
+def encode(value: Dict[str, Any], schema: Optional[str] = None, codec: str = "json") -> bytes:
+    codec = available_codec(codec)
+    if codec == "json":
+        return json.dumps(value).encode("utf-8")
+
+    schema_id = SCHEMA_IDS.get(schema, 0)
+    body = value
+    if schema_id:
+        body = [value.get(field) for field in SCHEMAS[schema_id][1]]
+
+    if codec == "msgpack":
+        data = msgpack.packb(body, use_bin_type=True)
+    else:
+        data = orjson.dumps(body)
+    return bytes((MAGIC, VERSION, CODEC_IDS[codec], schema_id)) + data
+
+
+def decode(data: bytes) -> Dict[str, Any]:
+    if not data or data[0] != MAGIC:
+        return json.loads(data.decode("utf-8"))
+
+    version, codec_id, schema_id = data[1], data[2], data[3]
+    if version != VERSION:
+        raise ValueError(f"Unsupported wire format version {version}")
+
+    codec = CODEC_NAMES.get(codec_id)
+    body = data[4:]
+    if codec == "msgpack" and msgpack is not None:
+        value = msgpack.unpackb(body, raw=False)
+    elif codec == "orjson":
+        value = orjson.loads(body) if orjson is not None else json.loads(body.decode("utf-8"))
+    else:
+        raise ValueError(f"Unsupported wire format codec {codec_id}")
+
+    if not schema_id:
+        return value
+    if schema_id not in SCHEMAS:
+        raise ValueError(f"Unknown wire format schema {schema_id}")
+    return dict(zip(SCHEMAS[schema_id][1], value))